@@ -9,13 +9,16 @@
         "base_import",
         "contacts",
         "sale_management",
+        "sale_stock",
         "purchase",
         "account",
         "product",
         "stock",
+        "stock_account",
         "mrp",
         "hr",
-        "l10n_in"
+        "l10n_in",
+        "bus"
     ],
     "data": [
         "security/security.xml",
@@ -47,7 +50,14 @@
 
         # Wizard & reports
         "wizard/bms_report_wizard_view.xml",
+        "wizard/bms_gst_return_wizard_view.xml",
         "reports/bms_report_templates.xml",
+        "views/bms_report_run_views.xml",
+        "reports/bms_statement_templates.xml",
+        "views/bms_statement_batch_views.xml",
+        "data/bms_report_cron.xml",
+        "views/bms_daily_fact_views.xml",
+        "data/bms_daily_fact_data.xml",
     ],
     "installable": True,
     "application": True,
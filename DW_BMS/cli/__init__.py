@@ -0,0 +1 @@
+from . import bms_benchmark
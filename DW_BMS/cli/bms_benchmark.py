@@ -0,0 +1,368 @@
+"""
+``odoo-bin bms_benchmark``: seed scale data and benchmark the BMS report
+collectors.
+
+Every report type is run with a few representative filter sets and output
+formats; wall time, SQL query count and peak Python memory (tracemalloc) are
+reported per run. With ``--thresholds`` the results are checked against a
+stored JSON baseline and the command exits non-zero on a regression;
+``--save-thresholds`` writes the current results as the new baseline.
+
+Seeded data is rolled back at the end unless ``--keep-data`` is given, so
+the command is meant for a test copy of the database::
+
+    odoo-bin bms_benchmark -d bms_bench --scale 10 --thresholds bench.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+from pathlib import Path
+
+import odoo
+from odoo import SUPERUSER_ID, api, fields
+from odoo.cli import Command
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+BENCH_PREFIX = "BMS-BENCH"
+SEED_BATCH_SIZE = 100
+METRICS = ("seconds", "queries", "peak_mb")
+# Absolute slack over a baseline, so noise on tiny baselines is not a regression.
+METRIC_MIN_SLACK = {"seconds": 0.05, "queries": 2, "peak_mb": 1.0}
+
+DEFAULT_VOLUMES = {
+    "partners": 200,
+    "products": 200,
+    "quants": 200,
+    "sale_orders": 500,
+    "purchase_orders": 300,
+    "invoices": 500,
+    "payments": 300,
+}
+
+OUTPUT_FORMATS = {
+    "data": lambda wizard: wizard._collect_data(),
+    "xlsx": lambda wizard: wizard._render_report("xlsx"),
+    "pdf": lambda wizard: wizard._render_report("pdf"),
+}
+
+
+def _busiest_partner(env):
+    groups = env["account.move"]._read_group(
+        [("state", "=", "posted"), ("partner_id", "!=", False)],
+        ["partner_id"],
+        ["__count"],
+        order="__count desc",
+        limit=1,
+    )
+    return {"partner_id": groups[0][0].id} if groups else {}
+
+
+FILTER_SETS = {
+    "all": lambda env: {},
+    "last_90_days": lambda env: {
+        "date_from": fields.Date.today() - timedelta(days=90),
+        "date_to": fields.Date.today(),
+    },
+    "one_partner": _busiest_partner,
+    "open_items": lambda env: {"payment_status": "not_paid", "shipping_status": "pending"},
+}
+
+
+class BenchmarkSeeder:
+    """Creates deterministic volumes of documents through the ORM, in batches."""
+
+    def __init__(self, env, volumes, seed=0):
+        self.env = env
+        self.volumes = volumes
+        self.rng = random.Random(seed)
+        self.today = fields.Date.today()
+
+    def _batches(self, count):
+        for start in range(0, count, SEED_BATCH_SIZE):
+            yield range(start, min(start + SEED_BATCH_SIZE, count))
+
+    def _random_date(self, days=365):
+        return self.today - timedelta(days=self.rng.randrange(days))
+
+    def _lines(self, products, count=3):
+        return [self.rng.choice(products) for _index in range(self.rng.randint(1, count))]
+
+    def seed(self):
+        started = time.perf_counter()
+        self.customers, self.suppliers = self._seed_partners()
+        self.products = self._seed_products()
+        self._seed_quants()
+        self._seed_sale_orders()
+        self._seed_purchase_orders()
+        self._seed_invoices()
+        self._seed_payments()
+        self.env.flush_all()
+        _logger.info("Seeded %s in %.1fs", self.volumes, time.perf_counter() - started)
+
+    def _seed_partners(self):
+        Partner = self.env["res.partner"]
+        partners = Partner
+        for batch in self._batches(self.volumes["partners"]):
+            partners |= Partner.create(
+                [
+                    {
+                        "name": f"{BENCH_PREFIX} Partner {index}",
+                        "is_company": True,
+                        "customer_rank": 1 if index % 2 == 0 else 0,
+                        "supplier_rank": 1 if index % 2 else 0,
+                        "email": f"bench{index}@example.com",
+                        # Phones are unique per company (res.partner constraint).
+                        "phone": f"+999{index:09d}",
+                    }
+                    for index in batch
+                ]
+            )
+        customers = partners.filtered("customer_rank")
+        return customers, (partners - customers)
+
+    def _seed_products(self):
+        Product = self.env["product.product"]
+        products = Product
+        for batch in self._batches(self.volumes["products"]):
+            vals_list = []
+            for index in batch:
+                price = round(self.rng.uniform(10, 5000), 2)
+                vals_list.append(
+                    {
+                        "name": f"{BENCH_PREFIX} Product {index}",
+                        "type": "product",
+                        "list_price": price,
+                        "standard_price": round(price * 0.7, 2),
+                    }
+                )
+            products |= Product.create(vals_list)
+        return products
+
+    def _seed_quants(self):
+        location = self.env["stock.warehouse"].search([("company_id", "=", self.env.company.id)], limit=1).lot_stock_id
+        Quant = self.env["stock.quant"].sudo()
+        for index in range(self.volumes["quants"]):
+            Quant._update_available_quantity(self.products[index % len(self.products)], location, self.rng.randint(1, 500))
+
+    def _seed_sale_orders(self):
+        for batch in self._batches(self.volumes["sale_orders"]):
+            orders = self.env["sale.order"].create(
+                [
+                    {
+                        "partner_id": self.rng.choice(self.customers).id,
+                        "date_order": self._random_date(),
+                        "order_line": [
+                            (0, 0, {"product_id": product.id, "product_uom_qty": self.rng.randint(1, 20), "price_unit": product.list_price})
+                            for product in self._lines(self.products)
+                        ],
+                    }
+                    for _index in batch
+                ]
+            )
+            orders.action_confirm()
+
+    def _seed_purchase_orders(self):
+        for batch in self._batches(self.volumes["purchase_orders"]):
+            orders = self.env["purchase.order"].create(
+                [
+                    {
+                        "partner_id": self.rng.choice(self.suppliers).id,
+                        "date_order": self._random_date(),
+                        "order_line": [
+                            (0, 0, {"product_id": product.id, "product_qty": self.rng.randint(1, 50), "price_unit": product.standard_price})
+                            for product in self._lines(self.products)
+                        ],
+                    }
+                    for _index in batch
+                ]
+            )
+            orders.button_confirm()
+
+    def _seed_invoices(self):
+        for batch in self._batches(self.volumes["invoices"]):
+            vals_list = []
+            for index in batch:
+                is_sale = index % 3 != 0
+                partners = self.customers if is_sale else self.suppliers
+                vals_list.append(
+                    {
+                        "move_type": "out_invoice" if is_sale else "in_invoice",
+                        "partner_id": self.rng.choice(partners).id,
+                        "invoice_date": self._random_date(),
+                        "invoice_line_ids": [
+                            (0, 0, {"product_id": product.id, "quantity": self.rng.randint(1, 20), "price_unit": product.list_price})
+                            for product in self._lines(self.products)
+                        ],
+                    }
+                )
+            self.env["account.move"].create(vals_list).action_post()
+
+    def _seed_payments(self):
+        journal = self.env["account.journal"].search(
+            [("type", "=", "bank"), ("company_id", "=", self.env.company.id)], limit=1
+        )
+        for batch in self._batches(self.volumes["payments"]):
+            vals_list = []
+            for index in batch:
+                inbound = index % 2 == 0
+                vals_list.append(
+                    {
+                        "payment_type": "inbound" if inbound else "outbound",
+                        "partner_type": "customer" if inbound else "supplier",
+                        "partner_id": self.rng.choice(self.customers if inbound else self.suppliers).id,
+                        "amount": round(self.rng.uniform(100, 50000), 2),
+                        "date": self._random_date(),
+                        "journal_id": journal.id,
+                    }
+                )
+            self.env["account.payment"].create(vals_list).action_post()
+
+
+class BmsBenchmark(Command):
+    """Seed scale data and benchmark the BMS report collectors"""
+
+    name = "bms_benchmark"
+
+    def _parser(self):
+        parser = argparse.ArgumentParser(
+            prog=f"{Path(sys.argv[0]).name} {self.name}",
+            description=self.__doc__,
+            epilog="Any other option is passed to the Odoo configuration (e.g. -d, -c).",
+        )
+        parser.add_argument("--no-seed", action="store_true", help="benchmark the existing data only")
+        parser.add_argument("--scale", type=float, default=1.0, help="multiplier applied to every volume")
+        for volume, default in DEFAULT_VOLUMES.items():
+            parser.add_argument(f"--{volume.replace('_', '-')}", dest=volume, type=int, default=default)
+        parser.add_argument("--seed", type=int, default=0, help="random seed of the data generator")
+        parser.add_argument(
+            "--report-types", help="comma-separated report types (default: all)"
+        )
+        parser.add_argument(
+            "--filters", default=",".join(FILTER_SETS), help=f"comma-separated filter sets among {', '.join(FILTER_SETS)}"
+        )
+        parser.add_argument(
+            "--formats", default="data,xlsx", help="comma-separated output formats among data, xlsx, pdf"
+        )
+        parser.add_argument("--login", default="admin", help="user the reports run as")
+        parser.add_argument("--thresholds", type=Path, help="JSON baseline to check the results against")
+        parser.add_argument(
+            "--tolerance", type=float, default=1.25, help="allowed ratio over a threshold before failing"
+        )
+        parser.add_argument("--save-thresholds", action="store_true", help="write the results as the new baseline")
+        parser.add_argument("--output", type=Path, help="also write the results as JSON to this file")
+        parser.add_argument("--keep-data", action="store_true", help="commit the seeded data")
+        return parser
+
+    def run(self, cmdargs):
+        parser = self._parser()
+        opts, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args)
+        dbname = config["db_name"]
+        if not dbname:
+            parser.error("a database is required (-d)")
+        volumes = {volume: int(getattr(opts, volume) * opts.scale) for volume in DEFAULT_VOLUMES}
+
+        registry = odoo.registry(dbname)
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            user = env["res.users"].search([("login", "=", opts.login)], limit=1)
+            if not user:
+                parser.error(f"unknown login {opts.login!r}")
+            env = env(user=user.id, context={"allowed_company_ids": user.company_ids.ids, "bms_report_no_cache": True})
+            if not opts.no_seed:
+                BenchmarkSeeder(env(su=True), volumes, opts.seed).seed()
+            results = self._benchmark(env, opts)
+            if opts.keep_data:
+                cr.commit()
+            else:
+                cr.rollback()
+
+        self._print(results)
+        if opts.output:
+            opts.output.write_text(json.dumps(results, indent=2, sort_keys=True))
+        if opts.save_thresholds:
+            if not opts.thresholds:
+                parser.error("--save-thresholds requires --thresholds")
+            opts.thresholds.write_text(json.dumps(results, indent=2, sort_keys=True))
+            return
+        if opts.thresholds:
+            regressions = self._regressions(results, json.loads(opts.thresholds.read_text()), opts.tolerance)
+            for message in regressions:
+                print(f"REGRESSION {message}")
+            if regressions:
+                sys.exit(1)
+
+    def _benchmark(self, env, opts):
+        report_types = [value for value, _label in env["bms.report.filter.mixin"]._fields["report_type"].selection]
+        if opts.report_types:
+            report_types = [value for value in opts.report_types.split(",") if value in report_types]
+        filter_sets = {name: FILTER_SETS[name](env) for name in opts.filters.split(",")}
+        formats = opts.formats.split(",")
+
+        results = {}
+        tracemalloc.start()
+        try:
+            for report_type in report_types:
+                for filter_name, filter_vals in filter_sets.items():
+                    for output_format in formats:
+                        key = f"{report_type}/{filter_name}/{output_format}"
+                        results[key] = self._measure(
+                            env, {"report_type": report_type, **filter_vals}, OUTPUT_FORMATS[output_format]
+                        )
+                        _logger.info("%s: %s", key, results[key])
+        finally:
+            tracemalloc.stop()
+        return results
+
+    def _measure(self, env, wizard_vals, render):
+        cr = env.cr
+        # A fresh wizard per run: no snapshot or ORM cache carried over.
+        wizard = env["bms.report.wizard"].create(wizard_vals)
+        env.flush_all()
+        env.invalidate_all()
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        queries_before = cr.sql_log_count
+        started = time.perf_counter()
+        try:
+            with cr.savepoint():
+                render(wizard)
+                env.flush_all()
+        except Exception as exc:  # a failing report is a result, not a crash
+            return {"error": str(exc)}
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            "queries": cr.sql_log_count - queries_before,
+            "peak_mb": round((tracemalloc.get_traced_memory()[1] - memory_before) / 1024 / 1024, 2),
+        }
+
+    def _regressions(self, results, thresholds, tolerance):
+        regressions = []
+        for key, result in sorted(results.items()):
+            if "error" in result:
+                regressions.append(f"{key}: failed ({result['error']})")
+                continue
+            threshold = thresholds.get(key)
+            if not threshold or "error" in threshold:
+                continue
+            for metric in METRICS:
+                limit = max(threshold[metric] * tolerance, threshold[metric] + METRIC_MIN_SLACK[metric])
+                if result[metric] > limit:
+                    regressions.append(f"{key}: {metric} {result[metric]} > {limit:.2f} (baseline {threshold[metric]})")
+        return regressions
+
+    def _print(self, results):
+        print(f"{'report / filters / format':<55} {'seconds':>9} {'queries':>8} {'peak MB':>8}")
+        for key, result in sorted(results.items()):
+            if "error" in result:
+                print(f"{key:<55} ERROR {result['error']}")
+            else:
+                print(f"{key:<55} {result['seconds']:>9.3f} {result['queries']:>8} {result['peak_mb']:>8.2f}")
@@ -0,0 +1 @@
+from . import bms_report_csv
@@ -0,0 +1,73 @@
+import csv
+import io
+import zlib
+
+import odoo
+from odoo import api, fields, http
+from odoo.http import content_disposition, request
+from werkzeug.exceptions import NotFound
+
+# Rows fetched per query while streaming.
+CSV_CHUNK_SIZE = 5000
+
+
+def _stream_csv(dbname, uid, context, wizard_id, table, compress):
+    """
+    Yield the CSV (gzip when ``compress``) of ``table`` chunk by chunk.
+
+    Runs after the request's own cursor is closed, on a dedicated cursor:
+    the rows are read in keyset pages of CSV_CHUNK_SIZE, each bound with
+    the user's record rules, so only one chunk is ever held in Python. The
+    dedicated transaction sees one snapshot, so pages are consistent.
+    """
+    # wbits=31: zlib writes a gzip container.
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+
+    with odoo.registry(dbname).cursor() as cr:
+        wizard = api.Environment(cr, uid, context)["bms.report.wizard"].browse(wizard_id)
+        header, _select, keys = wizard._csv_tables()[table]
+        writer.writerow(header)
+        yield flush()
+        after = None
+        while True:
+            cr.execute(wizard._csv_chunk(table, after, CSV_CHUNK_SIZE))
+            rows = cr.fetchall()
+            # The trailing key columns page the query; they are not exported.
+            writer.writerows(row[:-len(keys)] for row in rows)
+            yield flush()
+            if len(rows) < CSV_CHUNK_SIZE:
+                break
+            after = rows[-1][-len(keys):]
+    if compressor:
+        yield compressor.flush()
+
+
+class BmsReportCsvController(http.Controller):
+    @http.route("/dw_bms/report/<int:wizard_id>/csv/<string:table>", type="http", auth="user")
+    def export_csv(self, wizard_id, table, compress=None, **kwargs):
+        wizard = request.env["bms.report.wizard"].browse(wizard_id).exists()
+        if not wizard:
+            raise NotFound()
+        # Transient records are readable by their creator only.
+        wizard.check_access_rights("read")
+        wizard.check_access_rule("read")
+        if table not in wizard._csv_tables():
+            raise NotFound()
+
+        compress = bool(compress)
+        filename = f"bms_{table}_{fields.Date.today()}.csv" + (".gz" if compress else "")
+        return request.make_response(
+            _stream_csv(request.db, request.env.uid, dict(request.env.context), wizard.id, table, compress),
+            headers=[
+                ("Content-Type", "application/gzip" if compress else "text/csv; charset=utf-8"),
+                ("Content-Disposition", content_disposition(filename)),
+            ],
+        )
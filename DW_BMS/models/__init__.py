@@ -2,13 +2,22 @@ from . import res_partner
 from . import customer_type
 from . import account_move
 from . import sale_order
+from . import stock_move
 from . import base_import_fix
 from . import product_alias
+from . import bms_report_filter
 from . import bms_report_wizard
+from . import bms_report_run
+from . import bms_report_schedule
+from . import bms_report_cache
+from . import bms_daily_fact
+from . import bms_statement_batch
+from . import bms_gst_return_wizard
 from . import product_alert
 from . import product_extensions
 from . import product_storage_location
 from . import purchase_order_line
 from . import invoice_import_log
 from . import invoice_import_column_map
+from . import invoice_import_key
 from . import invoice_import_wizard
@@ -0,0 +1,351 @@
+"""
+Daily sales / purchase / invoice / payment facts.
+
+One row per (document type, date, company, partner, user) with untaxed and
+total amounts, open residual and document count, so period totals read a
+few thousand rows instead of every document.
+
+Source models mark the (document type, date, company) slices they touch in
+``bms.daily.fact.dirty`` when documents are confirmed, posted, cancelled,
+reset or reconciled, or when the lines of orders change; the refresh cron recomputes just those slices from the
+source tables. Recomputing outside the user's transaction keeps document
+validation fast and avoids concurrent updates of the same fact rows.
+``bms.daily.fact._rebuild()`` recomputes everything.
+"""
+
+from odoo import api, fields, models
+from odoo.tools.sql import create_index
+
+DOC_TYPES = [
+    ("sale_order", "Sales Order"),
+    ("purchase_order", "Purchase Order"),
+    ("out_invoice", "Customer Invoice"),
+    ("out_refund", "Customer Credit Note"),
+    ("in_invoice", "Vendor Bill"),
+    ("in_refund", "Vendor Refund"),
+    ("inbound_payment", "Customer Payment"),
+    ("outbound_payment", "Vendor Payment"),
+]
+
+INVOICE_DOC_TYPES = ("out_invoice", "out_refund", "in_invoice", "in_refund")
+
+
+def _order_source(table, states):
+    return {
+        "from": f"{table} doc",
+        "date": "doc.date_order::date",
+        "range": "doc.date_order",
+        "company": "doc.company_id",
+        "partner": "doc.partner_id",
+        "user": "doc.user_id",
+        "untaxed": "doc.amount_untaxed",
+        "total": "doc.amount_total",
+        "residual": "0.0",
+        "where": f"doc.state IN {states}",
+    }
+
+
+def _invoice_source(move_type):
+    # Signed company-currency amounts, as the reports use.
+    return {
+        "from": "account_move doc",
+        "date": "doc.invoice_date",
+        "range": "doc.invoice_date",
+        "company": "doc.company_id",
+        "partner": "doc.partner_id",
+        "user": "doc.invoice_user_id",
+        "untaxed": "doc.amount_untaxed_signed",
+        "total": "doc.amount_total_signed",
+        "residual": "doc.amount_residual_signed",
+        "where": f"doc.state = 'posted' AND doc.move_type = '{move_type}'",
+    }
+
+
+def _payment_source(payment_type):
+    return {
+        "from": "account_payment pay JOIN account_move doc ON doc.id = pay.move_id",
+        "date": "doc.date",
+        "range": "doc.date",
+        "company": "doc.company_id",
+        "partner": "pay.partner_id",
+        "user": "pay.create_uid",
+        "untaxed": "pay.amount_company_currency_signed",
+        "total": "pay.amount_company_currency_signed",
+        "residual": "0.0",
+        "where": f"doc.state = 'posted' AND pay.payment_type = '{payment_type}'",
+    }
+
+
+FACT_SOURCES = {
+    "sale_order": _order_source("sale_order", "('sale', 'done')"),
+    "purchase_order": _order_source("purchase_order", "('purchase', 'done')"),
+    **{move_type: _invoice_source(move_type) for move_type in INVOICE_DOC_TYPES},
+    "inbound_payment": _payment_source("inbound"),
+    "outbound_payment": _payment_source("outbound"),
+}
+
+
+class BmsDailyFact(models.Model):
+    _name = "bms.daily.fact"
+    _description = "BMS Daily Fact"
+    _order = "date desc, doc_type"
+    _log_access = False
+
+    doc_type = fields.Selection(DOC_TYPES, string="Document Type", required=True, readonly=True)
+    date = fields.Date(required=True, readonly=True, index=True)
+    company_id = fields.Many2one("res.company", required=True, readonly=True, ondelete="cascade")
+    partner_id = fields.Many2one("res.partner", readonly=True, ondelete="set null")
+    user_id = fields.Many2one("res.users", string="User", readonly=True, ondelete="set null")
+    currency_id = fields.Many2one(related="company_id.currency_id")
+    amount_untaxed = fields.Monetary(string="Untaxed Amount", readonly=True)
+    amount_total = fields.Monetary(string="Total", readonly=True)
+    amount_residual = fields.Monetary(string="Amount Due", readonly=True)
+    doc_count = fields.Integer(string="Documents", readonly=True)
+
+    def init(self):
+        create_index(
+            self.env.cr,
+            "bms_daily_fact_slice_idx",
+            self._table,
+            ["doc_type", "date", "company_id"],
+        )
+
+    @api.model
+    def _refresh(self, doc_type, slices=None):
+        """
+        Recompute the facts of ``doc_type`` from its source table, for the
+        given ``(date, company_id)`` slices or, when None, for all dates.
+        """
+        source = FACT_SOURCES[doc_type]
+        self.env.flush_all()
+        cr = self.env.cr
+        params = {"doc_type": doc_type}
+        slice_filter = ""
+        if slices is None:
+            cr.execute("DELETE FROM bms_daily_fact WHERE doc_type = %(doc_type)s", params)
+        else:
+            if not slices:
+                return
+            dates, company_ids = zip(*slices)
+            params.update(dates=list(dates), company_ids=list(company_ids), date_min=min(dates), date_max=max(dates))
+            cr.execute(
+                """
+                DELETE FROM bms_daily_fact
+                 WHERE doc_type = %(doc_type)s
+                   AND (date, company_id) IN (SELECT * FROM unnest(%(dates)s::date[], %(company_ids)s::int[]))
+                """,
+                params,
+            )
+            # The range bound lets the planner use the date index of the source table.
+            slice_filter = f"""
+                AND {source['range']} >= %(date_min)s
+                AND {source['range']} < %(date_max)s::date + 1
+                AND ({source['date']}, {source['company']})
+                    IN (SELECT * FROM unnest(%(dates)s::date[], %(company_ids)s::int[]))
+            """
+        cr.execute(
+            f"""
+            INSERT INTO bms_daily_fact (doc_type, date, company_id, partner_id, user_id,
+                                        amount_untaxed, amount_total, amount_residual, doc_count)
+            SELECT %(doc_type)s, {source['date']}, {source['company']}, {source['partner']}, {source['user']},
+                   SUM({source['untaxed']}), SUM({source['total']}), SUM({source['residual']}), COUNT(*)
+              FROM {source['from']}
+             WHERE {source['where']}
+               AND {source['date']} IS NOT NULL
+               {slice_filter}
+          GROUP BY 2, 3, 4, 5
+            """,
+            params,
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild(self):
+        """Full refresh: recompute every fact and drop pending slices."""
+        self.env.cr.execute("DELETE FROM bms_daily_fact_dirty")
+        for doc_type in FACT_SOURCES:
+            self._refresh(doc_type)
+
+    @api.model
+    def _pending_dates(self, doc_types, domain):
+        """Sorted dates of the pending slices of ``doc_types`` matching ``domain``."""
+        pending = self.env["bms.daily.fact.dirty"].sudo().search([("doc_type", "in", list(doc_types))] + domain)
+        return sorted(set(pending.mapped("date")))
+
+    def action_rebuild(self):
+        self.sudo()._rebuild()
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": "Daily Facts",
+                "message": "Daily facts have been rebuilt.",
+                "type": "success",
+                "next": {"type": "ir.actions.client", "tag": "reload"},
+            },
+        }
+
+
+class BmsDailyFactDirty(models.Model):
+    _name = "bms.daily.fact.dirty"
+    _description = "BMS Daily Fact Pending Slice"
+    _log_access = False
+
+    doc_type = fields.Selection(DOC_TYPES, required=True)
+    date = fields.Date(required=True)
+    company_id = fields.Many2one("res.company", required=True, ondelete="cascade")
+
+    @api.model
+    def _mark(self, keys):
+        """Queue ``(doc_type, date, company_id)`` slices; duplicates are merged by the cron."""
+        keys = [key for key in keys if key[1] and key[2]]
+        if not keys:
+            return
+        doc_types, dates, company_ids = zip(*keys)
+        # Plain inserts (no unique key) never conflict between concurrent transactions.
+        self.env.cr.execute(
+            """
+            INSERT INTO bms_daily_fact_dirty (doc_type, date, company_id)
+            SELECT * FROM unnest(%s::varchar[], %s::date[], %s::int[])
+            """,
+            [list(doc_types), list(dates), list(company_ids)],
+        )
+
+    @api.model
+    def _cron_refresh_facts(self):
+        self.env.cr.execute("DELETE FROM bms_daily_fact_dirty RETURNING doc_type, date, company_id")
+        slices_by_type = {}
+        for doc_type, date, company_id in set(self.env.cr.fetchall()):
+            slices_by_type.setdefault(doc_type, []).append((date, company_id))
+        Fact = self.env["bms.daily.fact"]
+        for doc_type, slices in slices_by_type.items():
+            Fact._refresh(doc_type, slices)
+
+
+class BmsDailyFactSource(models.AbstractModel):
+    """Marks the fact slices of documents whose reported values change."""
+
+    _name = "bms.daily.fact.source"
+    _description = "BMS Daily Fact Source"
+
+    # Written fields that can move a document into, out of or across fact slices.
+    _bms_fact_trigger_fields = ()
+
+    def _bms_fact_keys(self):
+        return set()
+
+    def _bms_mark_facts(self, keys):
+        if keys:
+            self.env["bms.daily.fact.dirty"].sudo()._mark(keys)
+
+    def write(self, vals):
+        if not self._bms_fact_trigger_fields or not set(vals).intersection(self._bms_fact_trigger_fields):
+            return super().write(vals)
+        keys = self._bms_fact_keys()
+        result = super().write(vals)
+        self._bms_mark_facts(keys | self._bms_fact_keys())
+        return result
+
+
+class BmsDailyFactSourceLine(models.AbstractModel):
+    """Marks the fact slices of the documents whose lines are added, changed or removed."""
+
+    _name = "bms.daily.fact.source.line"
+    _inherit = "bms.daily.fact.source"
+    _description = "BMS Daily Fact Source Line"
+
+    # Field of the line holding its document.
+    _bms_fact_document = None
+
+    def _bms_fact_keys(self):
+        return self.mapped(self._bms_fact_document)._bms_fact_keys()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._bms_mark_facts(lines._bms_fact_keys())
+        return lines
+
+    def unlink(self):
+        self._bms_mark_facts(self._bms_fact_keys())
+        return super().unlink()
+
+
+class SaleOrder(models.Model):
+    _name = "sale.order"
+    _inherit = ["sale.order", "bms.daily.fact.source"]
+
+    _bms_fact_trigger_fields = ("state", "date_order", "partner_id", "user_id", "company_id", "order_line")
+
+    def _bms_fact_keys(self):
+        return {
+            ("sale_order", order.date_order.date(), order.company_id.id)
+            for order in self
+            if order.state in ("sale", "done") and order.date_order
+        }
+
+
+class PurchaseOrder(models.Model):
+    _name = "purchase.order"
+    _inherit = ["purchase.order", "bms.daily.fact.source"]
+
+    _bms_fact_trigger_fields = ("state", "date_order", "partner_id", "user_id", "company_id", "order_line")
+
+    def _bms_fact_keys(self):
+        return {
+            ("purchase_order", order.date_order.date(), order.company_id.id)
+            for order in self
+            if order.state in ("purchase", "done") and order.date_order
+        }
+
+
+class SaleOrderLine(models.Model):
+    _name = "sale.order.line"
+    _inherit = ["sale.order.line", "bms.daily.fact.source.line"]
+
+    # Order totals are stored computes of the lines: they never go through the order's write.
+    _bms_fact_document = "order_id"
+    _bms_fact_trigger_fields = ("order_id", "product_uom_qty", "price_unit", "discount", "tax_id", "display_type")
+
+
+class PurchaseOrderLine(models.Model):
+    _name = "purchase.order.line"
+    _inherit = ["purchase.order.line", "bms.daily.fact.source.line"]
+
+    _bms_fact_document = "order_id"
+    _bms_fact_trigger_fields = ("order_id", "product_qty", "price_unit", "discount", "taxes_id", "display_type")
+
+
+class AccountMove(models.Model):
+    _name = "account.move"
+    _inherit = ["account.move", "bms.daily.fact.source"]
+
+    _bms_fact_trigger_fields = ("state", "invoice_date", "date", "partner_id", "invoice_user_id", "company_id")
+
+    def _bms_fact_keys(self):
+        keys = set()
+        for move in self.filtered(lambda m: m.state == "posted"):
+            if move.move_type in INVOICE_DOC_TYPES:
+                keys.add((move.move_type, move.invoice_date, move.company_id.id))
+            elif move.payment_id:
+                keys.add((f"{move.payment_id.payment_type}_payment", move.date, move.company_id.id))
+        return keys
+
+
+class AccountPartialReconcile(models.Model):
+    _inherit = "account.partial.reconcile"
+
+    def _bms_reconciled_moves(self):
+        return (self.debit_move_id | self.credit_move_id).move_id
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        partials = super().create(vals_list)
+        moves = partials._bms_reconciled_moves()
+        moves._bms_mark_facts(moves._bms_fact_keys())
+        return partials
+
+    def unlink(self):
+        moves = self._bms_reconciled_moves()
+        moves._bms_mark_facts(moves._bms_fact_keys())
+        return super().unlink()
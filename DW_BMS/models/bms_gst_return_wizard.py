@@ -0,0 +1,405 @@
+import json
+import tempfile
+from datetime import timedelta
+
+import xlsxwriter
+from odoo import fields, models
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+from .bms_report_wizard import XLSX_MIMETYPE
+
+# Inter-state invoices to unregistered recipients above this value are
+# reported invoice-wise (B2CL) instead of in the B2CS summary.
+B2CL_INVOICE_LIMIT = 100000.0
+
+TAX_HEADERS = ["Taxable Value", "IGST", "CGST", "SGST"]
+
+GSTR1_SECTIONS = {
+    "b2b": (
+        "B2B",
+        ["GSTIN of Recipient", "Invoice Number", "Invoice Date", "Invoice Value", "Place of Supply", "Rate"]
+        + TAX_HEADERS,
+    ),
+    "b2cl": ("B2CL", ["Invoice Number", "Invoice Date", "Invoice Value", "Place of Supply", "Rate"] + TAX_HEADERS),
+    "cdnr": (
+        "CDNR",
+        ["GSTIN of Recipient", "Note Number", "Note Date", "Note Value", "Place of Supply", "Rate"] + TAX_HEADERS,
+    ),
+    "b2cs": ("B2CS", ["Supply Type", "Place of Supply", "Rate"] + TAX_HEADERS),
+    "nil": ("Nil Exempt", ["Description", "Nil Rated", "Exempted", "Non-GST"]),
+    "hsn_b2b": ("HSN B2B", ["HSN", "UQC", "Quantity", "Total Value", "Rate"] + TAX_HEADERS),
+    "hsn_b2c": ("HSN B2C", ["HSN", "UQC", "Quantity", "Total Value", "Rate"] + TAX_HEADERS),
+}
+
+# Rows of the nil rated / exempt / non-GST table: (inter-state, registered, portal code, description).
+NIL_SUPPLY_TYPES = [
+    (True, True, "INTRB2B", "Inter-State supplies to registered persons"),
+    (False, True, "INTRAB2B", "Intra-State supplies to registered persons"),
+    (True, False, "INTRB2C", "Inter-State supplies to unregistered persons"),
+    (False, False, "INTRAB2C", "Intra-State supplies to unregistered persons"),
+]
+
+
+def _gst_date(value):
+    return value.strftime("%d-%m-%Y")
+
+
+class BmsGstReturnWizard(models.TransientModel):
+    """
+    GSTR-1 of one month from the posted customer invoices and credit notes.
+
+    Every invoice line of the period is normalised once into a temporary
+    table (taxable value, rate, IGST / CGST / SGST, recipient GSTIN, place of
+    supply, HSN, section); each GSTR-1 table is then a grouped query over it.
+    Imported GST amounts (``dw_*`` line fields) are used as they are; other
+    lines are split from their untaxed amount and GST rate. Lines without GST
+    go to the nil rated / exempt / non-GST table, by their tax group.
+    """
+
+    _name = "bms.gst.return.wizard"
+    _description = "BMS GSTR-1 Export"
+
+    company_id = fields.Many2one("res.company", required=True, default=lambda self: self.env.company)
+    gstin = fields.Char(related="company_id.vat", string="GSTIN")
+    date_from = fields.Date(
+        required=True,
+        default=lambda self: (fields.Date.context_today(self).replace(day=1) - timedelta(days=1)).replace(day=1),
+    )
+    date_to = fields.Date(
+        required=True,
+        default=lambda self: fields.Date.context_today(self).replace(day=1) - timedelta(days=1),
+    )
+
+    def _check_period(self):
+        self.ensure_one()
+        if self.date_from > self.date_to or (self.date_from.year, self.date_from.month) != (
+            self.date_to.year,
+            self.date_to.month,
+        ):
+            raise UserError("A GSTR-1 return covers dates of one calendar month.")
+        if not self.gstin:
+            raise UserError("Set the GSTIN of the company first.")
+
+    def _tax_group_ids(self, *names):
+        """Ids of the company's l10n_in tax groups ``names`` (e.g. ``igst``), as loaded by its chart template."""
+        groups = [
+            self.env.ref(f"account.{self.company_id.id}_{name}_group", raise_if_not_found=False) for name in names
+        ]
+        return [group.id for group in groups if group]
+
+    def _prepare_gst_lines(self):
+        """(Re)create the ``bms_gst_line`` temporary table of the period's normalised invoice lines."""
+        self.env["account.move.line"].check_access_rights("read")
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("DROP TABLE IF EXISTS bms_gst_line")
+        cr.execute(
+            SQL(
+                """
+                CREATE TEMPORARY TABLE bms_gst_line ON COMMIT DROP AS
+                WITH base AS (
+                    SELECT aml.move_id,
+                           move.move_type,
+                           move.name AS move_name,
+                           move.invoice_date,
+                           ABS(move.amount_total_signed)::float AS invoice_value,
+                           CASE WHEN move.move_type = 'out_refund' THEN -1 ELSE 1 END AS sign,
+                           UPPER(NULLIF(TRIM(COALESCE(NULLIF(move.dw_customer_gstin, ''), partner.vat)), '')) AS gstin,
+                           COALESCE(
+                               SUBSTRING(move.dw_place_of_supply FROM '^[0-9]{2}'),
+                               pos_state.l10n_in_tin,
+                               company_state.l10n_in_tin
+                           ) AS pos,
+                           company_state.l10n_in_tin AS company_pos,
+                           COALESCE(NULLIF(TRIM(aml.hsn_code), ''), 'NA') AS hsn,
+                           COALESCE(NULLIF(SPLIT_PART(uom.l10n_in_code, '-', 1), ''), 'OTH') AS uqc,
+                           ABS(aml.quantity)::float AS quantity,
+                           -aml.balance::float AS untaxed,
+                           aml.dw_taxable_value,
+                           aml.dw_igst_amount,
+                           aml.dw_cgst_amount,
+                           aml.dw_sgst_amount,
+                           COALESCE(rates.rate, 0)::float AS tax_rate,
+                           CASE WHEN rates.exempt THEN 'exempt'
+                                WHEN rates.non_gst THEN 'non_gst'
+                                ELSE 'nil' END AS zero_kind
+                      FROM account_move_line aml
+                      JOIN account_move move ON move.id = aml.move_id
+                      JOIN res_partner partner ON partner.id = move.commercial_partner_id
+                      JOIN res_company company ON company.id = move.company_id
+                      JOIN res_partner company_partner ON company_partner.id = company.partner_id
+                 LEFT JOIN res_country_state company_state ON company_state.id = company_partner.state_id
+                 LEFT JOIN res_country_state pos_state ON pos_state.id = move.l10n_in_state_id
+                 LEFT JOIN uom_uom uom ON uom.id = aml.product_uom_id
+                 LEFT JOIN LATERAL (
+                           -- GST taxes are usually CGST + SGST groups: rate of the children.
+                           -- Only IGST / CGST / SGST count: cess, TCS and other taxes do not.
+                           SELECT SUM(COALESCE(child.amount, tax.amount)) FILTER (
+                                      WHERE COALESCE(child.amount_type, tax.amount_type) = 'percent'
+                                        AND COALESCE(child.tax_group_id, tax.tax_group_id)
+                                            = ANY(%(gst_group_ids)s::int[])
+                                  ) AS rate,
+                                  BOOL_OR(COALESCE(child.tax_group_id, tax.tax_group_id)
+                                          = ANY(%(exempt_group_ids)s::int[])) AS exempt,
+                                  BOOL_OR(COALESCE(child.tax_group_id, tax.tax_group_id)
+                                          = ANY(%(non_gst_group_ids)s::int[])) AS non_gst
+                             FROM account_move_line_account_tax_rel rel
+                             JOIN account_tax tax ON tax.id = rel.account_tax_id
+                        LEFT JOIN account_tax_filiation_rel filiation
+                               ON filiation.parent_tax = tax.id AND tax.amount_type = 'group'
+                        LEFT JOIN account_tax child ON child.id = filiation.child_tax
+                            WHERE rel.account_move_line_id = aml.id
+                           ) rates ON TRUE
+                     WHERE move.state = 'posted'
+                       AND move.move_type IN ('out_invoice', 'out_refund')
+                       AND move.company_id = %(company_id)s
+                       AND move.invoice_date BETWEEN %(date_from)s AND %(date_to)s
+                       AND aml.display_type = 'product'
+                ), valued AS (
+                    SELECT base.*,
+                           base.pos IS DISTINCT FROM base.company_pos AS inter_state,
+                           base.dw_taxable_value != 0 AS imported,
+                           CASE WHEN base.dw_taxable_value != 0 THEN base.sign * base.dw_taxable_value
+                                ELSE base.untaxed END AS txval,
+                           CASE WHEN base.tax_rate != 0 THEN base.tax_rate
+                                WHEN base.dw_taxable_value != 0 THEN ROUND(
+                                    ((base.dw_igst_amount + base.dw_cgst_amount + base.dw_sgst_amount)
+                                     / base.dw_taxable_value * 100)::numeric, 2)::float
+                                ELSE 0 END AS rate
+                      FROM base
+                )
+                SELECT move_id, move_type, move_name, invoice_date, invoice_value, gstin, pos, inter_state,
+                       hsn, uqc, sign * quantity AS qty, rate, zero_kind, txval,
+                       CASE WHEN imported THEN sign * dw_igst_amount
+                            WHEN inter_state THEN ROUND((txval * rate / 100)::numeric, 2)::float
+                            ELSE 0 END AS iamt,
+                       CASE WHEN imported THEN sign * dw_cgst_amount
+                            WHEN NOT inter_state THEN ROUND((txval * rate / 200)::numeric, 2)::float
+                            ELSE 0 END AS camt,
+                       CASE WHEN imported THEN sign * dw_sgst_amount
+                            WHEN NOT inter_state THEN ROUND((txval * rate / 200)::numeric, 2)::float
+                            ELSE 0 END AS samt,
+                       CASE WHEN rate = 0 THEN 'nil'
+                            WHEN gstin IS NOT NULL AND move_type = 'out_refund' THEN 'cdnr'
+                            WHEN gstin IS NOT NULL THEN 'b2b'
+                            WHEN move_type = 'out_invoice' AND inter_state AND invoice_value > %(b2cl_limit)s
+                                THEN 'b2cl'
+                            ELSE 'b2cs' END AS section
+                  FROM valued
+                """,
+                company_id=self.company_id.id,
+                gst_group_ids=self._tax_group_ids("igst", "cgst", "sgst"),
+                exempt_group_ids=self._tax_group_ids("exempt"),
+                non_gst_group_ids=self._tax_group_ids("non_gst_supplies"),
+                date_from=self.date_from,
+                date_to=self.date_to,
+                b2cl_limit=B2CL_INVOICE_LIMIT,
+            )
+        )
+
+    def _gstr1_tables(self):
+        """``{section: [row]}`` of the GSTR-1 tables, each from one grouped query."""
+        self.ensure_one()
+        self._check_period()
+        self._prepare_gst_lines()
+        cr = self.env.cr
+        tables = {section: [] for section in GSTR1_SECTIONS}
+        tax_sums = "SUM(txval), SUM(iamt), SUM(camt), SUM(samt)"
+
+        cr.execute(
+            f"""
+            SELECT section, gstin, move_name, invoice_date, invoice_value, pos, rate, {tax_sums}
+              FROM bms_gst_line
+             WHERE section IN ('b2b', 'b2cl', 'cdnr')
+          GROUP BY section, gstin, move_id, move_name, invoice_date, invoice_value, pos, rate
+          ORDER BY section, gstin, invoice_date, move_name, rate
+            """
+        )
+        for section, gstin, name, date, value, pos, rate, txval, iamt, camt, samt in cr.fetchall():
+            keys = [name, date, value, pos, rate] if section == "b2cl" else [gstin, name, date, value, pos, rate]
+            # Credit notes are reported with positive amounts.
+            sign = -1 if section == "cdnr" else 1
+            tables[section].append(keys + [sign * txval, sign * iamt, sign * camt, sign * samt])
+
+        cr.execute(
+            f"""
+            SELECT inter_state, pos, rate, {tax_sums}
+              FROM bms_gst_line
+             WHERE section = 'b2cs'
+          GROUP BY inter_state, pos, rate
+          ORDER BY pos, rate
+            """
+        )
+        for inter_state, pos, rate, txval, iamt, camt, samt in cr.fetchall():
+            tables["b2cs"].append(["INTER" if inter_state else "INTRA", pos, rate, txval, iamt, camt, samt])
+
+        cr.execute(
+            """
+            SELECT inter_state, gstin IS NOT NULL, zero_kind, SUM(txval)
+              FROM bms_gst_line
+             WHERE section = 'nil'
+          GROUP BY 1, 2, 3
+            """
+        )
+        nil_amounts = {}
+        for inter_state, registered, zero_kind, txval in cr.fetchall():
+            nil_amounts.setdefault((inter_state, registered), {})[zero_kind] = txval
+        for inter_state, registered, _code, description in NIL_SUPPLY_TYPES:
+            amounts = nil_amounts.get((inter_state, registered))
+            if amounts:
+                tables["nil"].append(
+                    [description] + [amounts.get(kind, 0.0) for kind in ("nil", "exempt", "non_gst")]
+                )
+
+        cr.execute(
+            f"""
+            SELECT section IN ('b2b', 'cdnr'), hsn, uqc, SUM(qty), SUM(txval + iamt + camt + samt), rate, {tax_sums}
+              FROM bms_gst_line
+          GROUP BY 1, hsn, uqc, rate
+          ORDER BY 1 DESC, hsn, uqc, rate
+            """
+        )
+        for registered, hsn, uqc, qty, value, rate, txval, iamt, camt, samt in cr.fetchall():
+            section = "hsn_b2b" if registered else "hsn_b2c"
+            tables[section].append([hsn, uqc, qty, value, rate, txval, iamt, camt, samt])
+        cr.execute("DROP TABLE bms_gst_line")
+        return tables
+
+    def _gstr1_json(self, tables):
+        """The GSTR-1 tables in the layout of the GST portal's JSON upload."""
+
+        def items(rate, txval, iamt, camt, samt, number=1):
+            return {
+                "num": number,
+                "itm_det": {
+                    "rt": float(rate),
+                    "txval": round(float(txval), 2),
+                    "iamt": round(float(iamt), 2),
+                    "camt": round(float(camt), 2),
+                    "samt": round(float(samt), 2),
+                    "csamt": 0,
+                },
+            }
+
+        def documents(rows, number_key, date_key):
+            by_document = {}
+            for name, date, value, pos, rate, *amounts in rows:
+                document = by_document.setdefault(
+                    name,
+                    {
+                        number_key: name,
+                        date_key: _gst_date(date),
+                        "val": round(float(value), 2),
+                        "pos": pos,
+                        "itms": [],
+                    },
+                )
+                document["itms"].append(items(rate, *amounts, number=len(document["itms"]) + 1))
+            return list(by_document.values())
+
+        def by_recipient(rows, number_key, date_key, list_key, extra):
+            recipients = {}
+            for gstin, *row in rows:
+                recipients.setdefault(gstin, []).append(row)
+            return [
+                {"ctin": gstin, list_key: [dict(doc, **extra) for doc in documents(doc_rows, number_key, date_key)]}
+                for gstin, doc_rows in recipients.items()
+            ]
+
+        nil_codes = {description: code for _inter, _registered, code, description in NIL_SUPPLY_TYPES}
+
+        b2cl = {}
+        for row in tables["b2cl"]:
+            b2cl.setdefault(row[3], []).append(row)
+
+        def hsn(rows):
+            return [
+                {
+                    "num": index,
+                    "hsn_sc": hsn_code,
+                    "uqc": uqc,
+                    "qty": round(float(qty), 2),
+                    "val": round(float(value), 2),
+                    "rt": float(rate),
+                    "txval": round(float(txval), 2),
+                    "iamt": round(float(iamt), 2),
+                    "camt": round(float(camt), 2),
+                    "samt": round(float(samt), 2),
+                    "csamt": 0,
+                }
+                for index, (hsn_code, uqc, qty, value, rate, txval, iamt, camt, samt) in enumerate(rows, 1)
+            ]
+
+        return {
+            "gstin": self.gstin,
+            "fp": self.date_to.strftime("%m%Y"),
+            "b2b": by_recipient(tables["b2b"], "inum", "idt", "inv", {"rchrg": "N", "inv_typ": "R"}),
+            "b2cl": [{"pos": pos, "inv": documents(rows, "inum", "idt")} for pos, rows in b2cl.items()],
+            "cdnr": by_recipient(tables["cdnr"], "nt_num", "nt_dt", "nt", {"ntty": "C", "rchrg": "N", "inv_typ": "R"}),
+            "b2cs": [
+                {
+                    "sply_ty": supply_type,
+                    "pos": pos,
+                    "typ": "OE",
+                    "rt": float(rate),
+                    "txval": round(float(txval), 2),
+                    "iamt": round(float(iamt), 2),
+                    "camt": round(float(camt), 2),
+                    "samt": round(float(samt), 2),
+                    "csamt": 0,
+                }
+                for supply_type, pos, rate, txval, iamt, camt, samt in tables["b2cs"]
+            ],
+            "nil": {
+                "inv": [
+                    {
+                        "sply_ty": nil_codes[description],
+                        "nil_amt": round(float(nil_amt), 2),
+                        "expt_amt": round(float(expt_amt), 2),
+                        "ngsup_amt": round(float(ngsup_amt), 2),
+                    }
+                    for description, nil_amt, expt_amt, ngsup_amt in tables["nil"]
+                ]
+            },
+            "hsn": {"hsn_b2b": hsn(tables["hsn_b2b"]), "hsn_b2c": hsn(tables["hsn_b2c"])},
+        }
+
+    def _gstr1_xlsx(self, tables):
+        """One sheet per GSTR-1 table, in the column order of the offline tool."""
+        Wizard = self.env["bms.report.wizard"]
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+            workbook = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+            bold = workbook.add_format({"bold": True})
+            money = workbook.add_format({"num_format": "#,##0.00"})
+            for section, (sheet_name, headers) in GSTR1_SECTIONS.items():
+                sheet = workbook.add_worksheet(sheet_name)
+                rows = (
+                    [_gst_date(value) if hasattr(value, "strftime") else value for value in row]
+                    for row in tables[section]
+                )
+                Wizard._write_table(sheet, 0, headers, rows, bold, money)
+            workbook.close()
+            tmp.seek(0)
+            return tmp.read()
+
+    def _export(self, extension, raw, mimetype):
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": f"GSTR1_{self.gstin}_{self.date_to.strftime('%m%Y')}.{extension}",
+                "raw": raw,
+                "mimetype": mimetype,
+                "res_model": self._name,
+                "res_id": self.id,
+            }
+        )
+        return self.env["bms.report.wizard"]._download_action(attachment)
+
+    def action_export_json(self):
+        self.ensure_one()
+        payload = self._gstr1_json(self._gstr1_tables())
+        return self._export("json", json.dumps(payload, indent=1).encode(), "application/json")
+
+    def action_export_xlsx(self):
+        self.ensure_one()
+        return self._export("xlsx", self._gstr1_xlsx(self._gstr1_tables()), XLSX_MIMETYPE)
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from psycopg2 import IntegrityError, OperationalError
+
+from odoo import api, fields, models
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+from .bms_report_payload import dumps, loads
+
+_logger = logging.getLogger(__name__)
+
+# Tables whose changes invalidate a cached payload, per report type.
+REPORT_CACHE_MODELS = {
+    "profit_loss": ["account.move", "res.partner", "bms.daily.fact"],
+    "gross_margin": [
+        "account.move",
+        "account.move.line",
+        "stock.valuation.layer",
+        "stock.move",
+        "sale.order.line",
+        "res.partner",
+        "ir.property",
+    ],
+    "purchase_sales": ["sale.order", "purchase.order", "stock.picking", "res.partner"],
+    "supplier_customer": ["res.partner", "account.move.line"],
+    "stock": ["stock.quant", "stock.move", "stock.valuation.layer", "product.product", "product.template", "ir.property"],
+    "stock_location": [
+        "stock.quant",
+        "stock.valuation.layer",
+        "product.product",
+        "product.template",
+        "dw.product.storage.location",
+    ],
+    "product_purchase": ["purchase.order", "purchase.order.line", "product.product", "res.partner"],
+    "product_sale_user": ["sale.order", "sale.order.line", "stock.picking", "product.product", "res.partner"],
+    "purchase_payment": ["account.move", "res.partner"],
+    "sales_payment": ["account.move", "res.partner"],
+    "bank": ["account.payment", "account.move", "account.journal", "res.partner"],
+}
+
+DEFAULT_MAX_AGE_MINUTES = 60
+DEFAULT_MAX_ENTRIES = 200
+
+
+class BmsReportCache(models.Model):
+    """
+    Collected report payloads keyed by a fingerprint of (report type,
+    filters, companies, user, language). An entry is served while no change
+    to the report's tables committed after the data it was collected from,
+    and while it is younger than ``DW_BMS.report_cache_max_age`` minutes; at
+    most ``DW_BMS.report_cache_max_entries`` entries are kept.
+
+    Statement-level triggers on the cached tables append the writing
+    transaction id to ``bms_report_change``. An entry keeps the transaction
+    snapshot its payload was collected in; a logged change whose transaction
+    is not visible in that snapshot, once committed, means the payload is
+    stale. Appending never blocks concurrent writers, and rolled back
+    changes are rolled back with their log row. A frequent cron prunes the
+    log rows every live snapshot already sees.
+    """
+
+    _name = "bms.report.cache"
+    _description = "BMS Report Cache"
+    _order = "create_date desc"
+
+    key = fields.Char(required=True, index=True)
+    report_type = fields.Char(required=True)
+    data_snapshot = fields.Char(required=True)
+    payload = fields.Text(required=True)
+
+    _sql_constraints = [
+        ("bms_report_cache_key_uniq", "unique(key)", "A report cache entry already exists for this key."),
+    ]
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bms_report_change (
+                table_name varchar NOT NULL,
+                txid bigint NOT NULL DEFAULT txid_current(),
+                changed_at timestamp NOT NULL DEFAULT (clock_timestamp() AT TIME ZONE 'UTC')
+            )
+            """
+        )
+        # Logged when written, not when the writing transaction started.
+        cr.execute(
+            "ALTER TABLE bms_report_change ALTER COLUMN changed_at SET DEFAULT (clock_timestamp() AT TIME ZONE 'UTC')"
+        )
+        create_index(cr, "bms_report_change_table_txid_idx", "bms_report_change", ["table_name", "txid"])
+        cr.execute(
+            """
+            CREATE OR REPLACE FUNCTION bms_report_log_change() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO bms_report_change (table_name) VALUES (TG_TABLE_NAME);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        # Some cached tables belong to models initialised after this one.
+        self.pool.post_init(self._install_change_triggers)
+
+    def _install_change_triggers(self):
+        cr = self.env.cr
+        tables = {self.env[model]._table for models_ in REPORT_CACHE_MODELS.values() for model in models_}
+        for table in sorted(tables):
+            cr.execute(
+                SQL(
+                    """
+                    DROP TRIGGER IF EXISTS bms_report_change ON %(table)s;
+                    CREATE TRIGGER bms_report_change
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %(table)s
+                        FOR EACH STATEMENT EXECUTE FUNCTION bms_report_log_change();
+                    """,
+                    table=SQL.identifier(table),
+                )
+            )
+
+    # ─── Keys & versions ─────────────────────────────────────────────────────
+    @api.model
+    def _fingerprint(self, wizard):
+        scope = {
+            "filters": wizard._filter_vals(),
+            "companies": sorted(wizard.env.companies.ids),
+            "uid": wizard.env.uid,
+            "lang": wizard.env.lang,
+            # Ageing buckets and other relative periods move with the day.
+            "today": fields.Date.context_today(wizard),
+        }
+        return hashlib.sha256(json.dumps(scope, sort_keys=True, default=str).encode()).hexdigest()
+
+    @api.model
+    def _data_snapshot(self):
+        """Snapshot of the current transaction; read it before collecting the payload to cache."""
+        self.env.cr.execute("SELECT txid_current_snapshot()::text")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _changed_since(self, report_type, snapshot):
+        """True when a change to ``report_type``'s tables is not visible in ``snapshot``."""
+        tables = [self.env[model]._table for model in REPORT_CACHE_MODELS.get(report_type, [])]
+        # Transactions below the snapshot's xmin are all visible in it.
+        self.env.cr.execute(
+            """
+            SELECT 1
+              FROM bms_report_change
+             WHERE table_name = ANY(%(tables)s)
+               AND txid >= txid_snapshot_xmin(%(snapshot)s::txid_snapshot)
+               AND NOT txid_visible_in_snapshot(txid, %(snapshot)s::txid_snapshot)
+             LIMIT 1
+            """,
+            {"tables": tables, "snapshot": snapshot},
+        )
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _max_age(self):
+        params = self.env["ir.config_parameter"].sudo()
+        return timedelta(minutes=int(params.get_param("DW_BMS.report_cache_max_age", DEFAULT_MAX_AGE_MINUTES)))
+
+    @api.model
+    def _max_entries(self):
+        params = self.env["ir.config_parameter"].sudo()
+        return int(params.get_param("DW_BMS.report_cache_max_entries", DEFAULT_MAX_ENTRIES))
+
+    # ─── Lookup / store ──────────────────────────────────────────────────────
+    @api.model
+    def _lookup(self, wizard):
+        """Cached payload for ``wizard``'s report, or None."""
+        entry = self.sudo().search([("key", "=", self._fingerprint(wizard))], limit=1)
+        if not entry:
+            return None
+        # Stale entries are left to _store and the autovacuum: a lookup never
+        # writes, so concurrent readers of the same report do not contend.
+        if entry.create_date < fields.Datetime.now() - self._max_age() or self._changed_since(
+            wizard.report_type, entry.data_snapshot
+        ):
+            return None
+        return loads(entry.payload)
+
+    @api.model
+    def _store(self, wizard, payload, snapshot):
+        """
+        Cache ``payload`` collected in the transaction ``snapshot`` (read
+        before collecting). Best effort: a failure to cache never fails the report.
+        """
+        Cache = self.sudo()
+        key = self._fingerprint(wizard)
+        try:
+            with self.env.cr.savepoint():
+                Cache.search([("key", "=", key)]).unlink()
+                Cache.create(
+                    {
+                        "key": key,
+                        "report_type": wizard.report_type,
+                        "data_snapshot": snapshot,
+                        "payload": dumps(payload),
+                    }
+                )
+        except (IntegrityError, OperationalError):
+            # A concurrent run of the same report stored it first.
+            _logger.info("BMS report cache entry %s not stored (concurrent update).", key)
+            return
+        Cache._evict_overflow()
+
+    def _evict_overflow(self):
+        surplus = self.search([], offset=self._max_entries(), order="create_date desc")
+        surplus.unlink()
+
+    @api.autovacuum
+    def _gc_expired_entries(self):
+        expiry = fields.Datetime.now() - self._max_age()
+        self.sudo().search([("create_date", "<", expiry)]).unlink()
+        self.sudo()._evict_overflow()
+
+    @api.model
+    def _prune_change_log(self):
+        """
+        Drop the change log rows visible in every snapshot that may still be
+        checked: those of live cache entries and report wizards, and any
+        snapshot taken from now on (transactions below the current xmin are
+        all finished).
+        """
+        self.env.cr.execute(
+            """
+            DELETE FROM bms_report_change
+             WHERE txid < LEAST(
+                       txid_snapshot_xmin(txid_current_snapshot()),
+                       (SELECT MIN(txid_snapshot_xmin(data_snapshot::txid_snapshot))
+                          FROM bms_report_cache
+                         WHERE create_date >= %(expiry)s),
+                       (SELECT MIN(txid_snapshot_xmin(payload_snapshot::txid_snapshot))
+                          FROM bms_report_wizard
+                         WHERE payload_snapshot IS NOT NULL)
+                   )
+            """,
+            {"expiry": fields.Datetime.now() - self._max_age()},
+        )
@@ -0,0 +1,111 @@
+import hashlib
+import json
+
+from odoo import fields, models
+
+# Fields describing "which report, for which data". Anything that stores a
+# report request (wizard, background run, ...) copies exactly these.
+REPORT_FILTER_FIELDS = [
+    "report_type",
+    "partner_id",
+    "partner_role",
+    "user_id",
+    "date_from",
+    "date_to",
+    "payment_status",
+    "shipping_status",
+    "bank_group_by_month",
+    "margin_group_by",
+    "compare_period",
+    "stock_date",
+]
+
+
+class BmsReportFilterMixin(models.AbstractModel):
+    _name = "bms.report.filter.mixin"
+    _description = "BMS Report Filters"
+
+    report_type = fields.Selection(
+        [
+            ("profit_loss", "Profit / Loss Report"),
+            ("gross_margin", "Gross Margin Report"),
+            ("purchase_sales", "Purchase / Sales Report"),
+            ("supplier_customer", "Supplier and Customer Report"),
+            ("stock", "Stock Report"),
+            ("stock_location", "Stock by Storage Location"),
+            ("product_purchase", "Products Purchase Report"),
+            ("product_sale_user", "Products Sale Report with Usernames"),
+            ("purchase_payment", "Purchase Payment / Pending Report"),
+            ("sales_payment", "Sales Payment Report"),
+            ("bank", "Bank Report"),
+        ],
+        required=True,
+        default="profit_loss",
+    )
+
+    partner_id = fields.Many2one("res.partner", string="Customer / Supplier")
+    partner_role = fields.Selection(
+        [("all", "All"), ("customer", "Customer"), ("supplier", "Supplier")],
+        default="all",
+        string="Partner Type",
+    )
+    user_id = fields.Many2one("res.users", string="User")
+    date_from = fields.Date(string="Date From")
+    date_to = fields.Date(string="Date To")
+    payment_status = fields.Selection(
+        [
+            ("all", "All"),
+            ("paid", "Paid"),
+            ("partial", "Partially Paid"),
+            ("not_paid", "Not Paid"),
+        ],
+        default="all",
+    )
+    shipping_status = fields.Selection(
+        [("all", "All"), ("done", "Delivered"), ("pending", "Pending")],
+        default="all",
+    )
+    bank_group_by_month = fields.Boolean(
+        string="Group by Month",
+        help="Bank report: split the journal summary by payment month.",
+    )
+
+    margin_group_by = fields.Selection(
+        [
+            ("product", "Product"),
+            ("category", "Product Category"),
+            ("customer", "Customer"),
+            ("salesperson", "Sales Person"),
+        ],
+        string="Margin By",
+        default="product",
+    )
+    compare_period = fields.Selection(
+        [
+            ("none", "No Comparison"),
+            ("previous_period", "Previous Period"),
+            ("previous_year", "Same Period Last Year"),
+        ],
+        string="Compare With",
+        default="none",
+        help="Profit / Loss, Purchase / Sales and product reports: also compute this "
+        "earlier period and the change from it to the selected dates.",
+    )
+
+    stock_date = fields.Date(
+        string="Stock As Of",
+        help="Stock report: quantities and valuation at the end of this day instead of now.",
+    )
+
+    def _filter_vals(self):
+        """Filter values of this record, ready for ``create`` on another filter holder."""
+        self.ensure_one()
+        return self._convert_to_write({name: self[name] for name in REPORT_FILTER_FIELDS})
+
+    def _filter_key(self, companies):
+        """Stable key of these filters over ``companies``, to match equivalent report requests."""
+        scope = [self._filter_vals(), sorted(companies.ids)]
+        return hashlib.sha256(json.dumps(scope, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _selection_label(self, field_name, value):
+        return dict(self._fields[field_name].selection).get(value)
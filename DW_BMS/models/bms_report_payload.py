@@ -0,0 +1,87 @@
+"""
+Compact serialised form of a collected BMS report payload.
+
+A payload is a dict of summary figures plus detail tables (lists or
+generators of row dicts). Tables are written row by row as gzip-compressed
+JSON lines tagged with their table name; only the compressed bytes are held
+in memory and rows are decoded lazily when read back. Summary figures and
+per-table row counts are returned separately: they are small and live on
+the owning record.
+"""
+
+import gzip
+import io
+import json
+from datetime import date, datetime
+from itertools import islice
+from types import GeneratorType
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Cannot serialise {type(value).__name__} in a report payload")
+
+
+def json_object_hook(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__date__" in obj:
+        return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def is_table(value):
+    return isinstance(value, (list, GeneratorType))
+
+
+def dumps(value):
+    return json.dumps(value, default=json_default)
+
+
+def loads(text):
+    return json.loads(text, object_hook=json_object_hook)
+
+
+def dump_payload(payload):
+    """
+    Serialise ``payload``; returns ``(raw, summary)`` where ``raw`` is the
+    gzip-compressed table rows and ``summary`` a dict with the summary
+    figures and per-table row counts.
+    """
+    figures = {}
+    row_counts = {}
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as stream:
+        for key, value in payload.items():
+            if not is_table(value):
+                figures[key] = value
+                continue
+            count = 0
+            for row in value:
+                stream.write(dumps([key, row]).encode() + b"\n")
+                count += 1
+            row_counts[key] = count
+    return buffer.getvalue(), {"figures": figures, "row_counts": row_counts}
+
+
+def _iter_rows(raw, table):
+    with gzip.GzipFile(fileobj=io.BytesIO(raw), mode="rb") as stream:
+        for line in stream:
+            key, row = loads(line)
+            if key == table:
+                yield row
+
+
+def load_payload(raw, summary, max_rows=None):
+    """
+    Rebuild a payload from :func:`dump_payload` output. Tables are lazy
+    generators, or lists of at most ``max_rows`` rows when a limit is given.
+    """
+    payload = dict(summary["figures"])
+    for table in summary["row_counts"]:
+        rows = _iter_rows(raw, table)
+        payload[table] = list(islice(rows, max_rows)) if max_rows is not None else rows
+    return payload
@@ -0,0 +1,195 @@
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+from odoo.exceptions import UserError
+
+from .bms_report_filter import REPORT_FILTER_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+# Runs generated per cron invocation; the cron re-triggers itself while more are queued.
+RUN_BATCH_SIZE = 5
+
+# A run is generated at most this many times; a worker killed mid-run counts as an attempt.
+RUN_MAX_ATTEMPTS = 3
+# A run still "running" after this long was interrupted (time limit, out of memory, restart).
+RUN_STALE_AFTER = timedelta(hours=1)
+
+OUTPUT_FORMATS = [("xlsx", "Excel"), ("pdf", "PDF"), ("xlsx_all", "Excel, All Reports")]
+
+
+class BmsReportRun(models.Model):
+    _name = "bms.report.run"
+    _inherit = "bms.report.filter.mixin"
+    _description = "BMS Report Run"
+    _order = "id desc"
+
+    name = fields.Char(compute="_compute_name", store=True)
+    output_format = fields.Selection(
+        OUTPUT_FORMATS,
+        required=True,
+        default="xlsx",
+    )
+    company_ids = fields.Many2many(
+        "res.company",
+        string="Companies",
+        help="Companies that were active when the report was requested.",
+    )
+    state = fields.Selection(
+        [
+            ("queued", "Queued"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="queued",
+        required=True,
+        readonly=True,
+        index=True,
+    )
+    attachment_id = fields.Many2one("ir.attachment", string="File", readonly=True, ondelete="set null")
+    date_done = fields.Datetime(string="Completed On", readonly=True)
+    error_message = fields.Text(readonly=True)
+    date_started = fields.Datetime(string="Started On", readonly=True)
+    attempt_count = fields.Integer(string="Attempts", readonly=True)
+    schedule_id = fields.Many2one("bms.report.schedule", readonly=True, index=True, ondelete="set null")
+    filter_key = fields.Char(compute="_compute_filter_key", store=True, index=True)
+
+    @api.depends("report_type", "output_format")
+    def _compute_name(self):
+        for run in self:
+            if run.output_format == "xlsx_all":
+                label = "All BMS Reports"
+            else:
+                label = run._selection_label("report_type", run.report_type) or "BMS Report"
+            run.name = f"{label} ({run._selection_label('output_format', run.output_format)})"
+
+    @api.depends(*REPORT_FILTER_FIELDS, "company_ids")
+    def _compute_filter_key(self):
+        for run in self:
+            run.filter_key = run._filter_key(run.company_ids)
+
+    def write(self, vals):
+        # A finished scheduled run is a snapshot: its file and filters are final.
+        if self.filtered(lambda run: run.schedule_id and run.state == "done"):
+            raise UserError("Report snapshots cannot be modified.")
+        return super().write(vals)
+
+    def _trigger_queue(self):
+        self.env.ref("DW_BMS.ir_cron_bms_report_run")._trigger()
+
+    def _make_wizard(self):
+        """A report wizard carrying this run's filters, as the requesting user and companies."""
+        self.ensure_one()
+        Wizard = self.env["bms.report.wizard"].with_user(self.create_uid)
+        if self.company_ids:
+            Wizard = Wizard.with_context(allowed_company_ids=self.company_ids.ids)
+        return Wizard.create(self._filter_vals())
+
+    def _start(self):
+        """
+        Mark the run running and count the attempt in their own transaction,
+        so a worker killed while generating leaves the run out of the queue.
+        """
+        self.ensure_one()
+        self.write(
+            {
+                "state": "running",
+                "error_message": False,
+                "date_started": fields.Datetime.now(),
+                "attempt_count": self.attempt_count + 1,
+            }
+        )
+        self.env.cr.commit()
+
+    def _generate(self):
+        self.ensure_one()
+        self._start()
+        try:
+            with self.env.cr.savepoint():
+                filename, raw, mimetype = self._make_wizard()._render_report(self.output_format)
+                attachment = self.env["ir.attachment"].sudo().create(
+                    {
+                        "name": filename,
+                        "raw": raw,
+                        "mimetype": mimetype,
+                        "res_model": self._name,
+                        "res_id": self.id,
+                    }
+                )
+        except Exception as exc:
+            _logger.exception("BMS report run %s failed", self.id)
+            self.write({"state": "failed", "error_message": str(exc)})
+        else:
+            self.write({"state": "done", "attachment_id": attachment.id, "date_done": fields.Datetime.now()})
+        self._notify_requester()
+
+    def _notify_requester(self):
+        self.ensure_one()
+        if self.state == "done":
+            message, notification_type = "Your report is ready. Open My Background Reports to download it.", "success"
+        else:
+            message, notification_type = "Your report could not be generated.", "danger"
+        self.env["bus.bus"]._sendone(
+            self.create_uid.partner_id,
+            "simple_notification",
+            {"title": self.name, "message": message, "type": notification_type, "sticky": True},
+        )
+
+    @api.model
+    def _recover_interrupted(self):
+        """Queue the runs interrupted while generating again, or fail them once out of attempts."""
+        stale = self.search(
+            [("state", "=", "running"), ("date_started", "<", fields.Datetime.now() - RUN_STALE_AFTER)]
+        )
+        exhausted = stale.filtered(lambda run: run.attempt_count >= RUN_MAX_ATTEMPTS)
+        (stale - exhausted).write({"state": "queued"})
+        for run in exhausted:
+            _logger.warning("BMS report run %s was interrupted %s times, giving up", run.id, run.attempt_count)
+            run.write({"state": "failed", "error_message": "Generation was interrupted too many times."})
+            run._notify_requester()
+
+    @api.model
+    def _cron_process_queue(self):
+        self._recover_interrupted()
+        self.env.cr.commit()
+        runs = self.search([("state", "=", "queued")], order="id", limit=RUN_BATCH_SIZE + 1)
+        for run in runs[:RUN_BATCH_SIZE]:
+            run._generate()
+            # One report per transaction: a finished file is never lost to a later failure.
+            self.env.cr.commit()
+        if len(runs) > RUN_BATCH_SIZE:
+            self._trigger_queue()
+
+    def action_download(self):
+        self.ensure_one()
+        return self.env["bms.report.wizard"]._download_action(self.attachment_id)
+
+    def action_refresh(self):
+        """Queue a live regeneration of this report as a new run."""
+        self.ensure_one()
+        run = self.copy(
+            {
+                "state": "queued",
+                "attachment_id": False,
+                "date_done": False,
+                "error_message": False,
+                "date_started": False,
+                "attempt_count": 0,
+                "schedule_id": False,
+            }
+        )
+        run._trigger_queue()
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": run.id,
+            "view_mode": "form",
+        }
+
+    def action_retry(self):
+        self.filtered(lambda run: run.state == "failed").write(
+            {"state": "queued", "error_message": False, "attempt_count": 0}
+        )
+        self._trigger_queue()
@@ -0,0 +1,165 @@
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models
+from odoo.exceptions import ValidationError
+
+from .bms_report_run import OUTPUT_FORMATS
+
+
+class BmsReportSchedule(models.Model):
+    """
+    Reports generated overnight as immutable snapshots (done
+    ``bms.report.run`` records linked to the schedule), so the morning's
+    readers download a ready file instead of all waiting on the same queries.
+    """
+
+    _name = "bms.report.schedule"
+    _inherit = "bms.report.filter.mixin"
+    _description = "BMS Report Schedule"
+    _order = "next_run_date, id"
+
+    name = fields.Char(required=True)
+    active = fields.Boolean(default=True)
+    output_format = fields.Selection(OUTPUT_FORMATS, required=True, default="xlsx")
+    date_range = fields.Selection(
+        [
+            ("fixed", "Filter Dates"),
+            ("previous_day", "Previous Day"),
+            ("previous_month", "Previous Month"),
+            ("month_to_date", "Month to Date"),
+        ],
+        required=True,
+        default="previous_month",
+        help="Period of each snapshot, resolved on the day it is generated.",
+    )
+    interval_number = fields.Integer(string="Every", required=True, default=1)
+    interval_type = fields.Selection(
+        [("days", "Days"), ("weeks", "Weeks"), ("months", "Months")],
+        required=True,
+        default="months",
+    )
+    next_run_date = fields.Date(
+        required=True,
+        default=lambda self: fields.Date.context_today(self).replace(day=1) + relativedelta(months=1),
+    )
+    run_as_user_id = fields.Many2one(
+        "res.users",
+        string="Run As",
+        required=True,
+        default=lambda self: self.env.user,
+        help="Snapshots are computed with this user's access rights.",
+    )
+    user_ids = fields.Many2many(
+        "res.users",
+        string="Shared With",
+        help="Users who can open the snapshots besides the run-as user. Snapshots hold what the run-as "
+        "user can see, so each of them must belong to every group of the run-as user.",
+    )
+    company_ids = fields.Many2many(
+        "res.company",
+        string="Companies",
+        required=True,
+        default=lambda self: self.env.companies,
+    )
+    keep_count = fields.Integer(
+        string="Snapshots Kept",
+        default=12,
+        help="Older snapshots of this schedule are deleted.",
+    )
+    run_ids = fields.One2many("bms.report.run", "schedule_id", string="Snapshots")
+    snapshot_count = fields.Integer(compute="_compute_snapshot_count")
+
+    _sql_constraints = [
+        ("bms_report_schedule_interval_positive", "CHECK(interval_number > 0)", "The interval must be positive."),
+    ]
+
+    @api.constrains("user_ids", "run_as_user_id")
+    def _check_audience(self):
+        for schedule in self:
+            groups = schedule.run_as_user_id.groups_id
+            outsiders = schedule.user_ids.filtered(lambda user: groups - user.groups_id)
+            if outsiders:
+                raise ValidationError(
+                    "Snapshots can only be shared with users holding every group of the run-as user: "
+                    + ", ".join(outsiders.mapped("name"))
+                )
+
+    @api.depends("run_ids")
+    def _compute_snapshot_count(self):
+        counts = {
+            schedule.id: count
+            for schedule, count in self.env["bms.report.run"]._read_group(
+                [("schedule_id", "in", self.ids)], ["schedule_id"], ["__count"]
+            )
+        }
+        for schedule in self:
+            schedule.snapshot_count = counts.get(schedule.id, 0)
+
+    def _resolve_dates(self, today):
+        if self.date_range == "previous_day":
+            day = today - timedelta(days=1)
+            return day, day
+        if self.date_range == "previous_month":
+            month_end = today.replace(day=1) - timedelta(days=1)
+            return month_end.replace(day=1), month_end
+        if self.date_range == "month_to_date":
+            return today.replace(day=1), today
+        return self.date_from, self.date_to
+
+    def _next_date(self, today):
+        step = relativedelta(**{self.interval_type: self.interval_number})
+        next_date = self.next_run_date
+        while next_date <= today:
+            next_date += step
+        return next_date
+
+    def _queue_snapshot(self, today):
+        self.ensure_one()
+        date_from, date_to = self._resolve_dates(today)
+        # Owned by the run-as user, so the run generates with that user's rights.
+        return self.env["bms.report.run"].with_user(self.run_as_user_id).sudo().create(
+            {
+                **self._filter_vals(),
+                "date_from": date_from,
+                "date_to": date_to,
+                "output_format": self.output_format,
+                "company_ids": [(6, 0, self.company_ids.ids)],
+                "schedule_id": self.id,
+            }
+        )
+
+    def _prune_snapshots(self):
+        for schedule in self:
+            snapshots = self.env["bms.report.run"].sudo().search(
+                [("schedule_id", "=", schedule.id), ("state", "=", "done")], order="date_done desc, id desc"
+            )
+            snapshots[schedule.keep_count:].unlink()
+
+    @api.model
+    def _cron_queue_snapshots(self):
+        today = fields.Date.context_today(self)
+        schedules = self.search([("next_run_date", "<=", today)])
+        for schedule in schedules:
+            schedule._queue_snapshot(today)
+            schedule.next_run_date = schedule._next_date(today)
+        schedules._prune_snapshots()
+        if schedules:
+            self.env["bms.report.run"]._trigger_queue()
+
+    def action_run_now(self):
+        today = fields.Date.context_today(self)
+        for schedule in self:
+            schedule._queue_snapshot(today)
+        self.env["bms.report.run"]._trigger_queue()
+
+    def action_view_snapshots(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": self.name,
+            "res_model": "bms.report.run",
+            "view_mode": "tree,form",
+            "domain": [("schedule_id", "=", self.id)],
+        }
@@ -1,59 +1,98 @@
-import base64
-from collections import defaultdict
-from io import BytesIO
+import tempfile
+from datetime import datetime, time, timedelta
+from types import GeneratorType
 
+import pytz
 import xlsxwriter
-from odoo import fields, models
+from dateutil.relativedelta import relativedelta
+from odoo import api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools import SQL, split_every
+
+from .bms_report_filter import REPORT_FILTER_FIELDS
+from .bms_report_payload import dump_payload, dumps, is_table, load_payload, loads
+
+# Rows fetched per round-trip when streaming report detail tables.
+REPORT_BATCH_SIZE = 2000
+
+# Detail rows per table printed in the PDF; the XLSX always has them all.
+PDF_MAX_ROWS = 500
+
+# Detail rows per table on one page of the on-screen preview.
+PREVIEW_PAGE_SIZE = 50
+
+# Fields read for the detail rows streamed from orders, invoices and payments.
+ORDER_LINE_FIELDS = ["name", "date_order", "partner_id", "amount_total"]
+PAYMENT_LINE_FIELDS = ["name", "invoice_date", "partner_id", "amount_total", "amount_residual", "payment_state"]
+BANK_DETAIL_FIELDS = ["date", "name", "journal_id", "partner_id", "amount"]
+
+# Payloads up to this many table rows are put in bms.report.cache.
+CACHE_MAX_ROWS = 20000
+
+# Gross margin grouping: (invoice line key, model of the key).
+MARGIN_GROUP_KEYS = {
+    "product": ("aml.product_id", "product.product"),
+    "category": ("tmpl.categ_id", "product.category"),
+    "customer": ("move.commercial_partner_id", "res.partner"),
+    "salesperson": ("move.invoice_user_id", "res.users"),
+}
+
+# Reports offering a period-over-period comparison.
+COMPARE_REPORT_TYPES = ("profit_loss", "purchase_sales", "product_purchase", "product_sale_user")
+
+# Move states counted in the forecast quantity, as virtual_available does.
+STOCK_PENDING_STATES = ("waiting", "confirmed", "partially_available", "assigned")
+
+PAYMENT_MOVE_TYPES = {
+    "purchase_payment": ("in_invoice", "in_refund"),
+    "sales_payment": ("out_invoice", "out_refund"),
+}
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 
 class BmsReportWizard(models.TransientModel):
     _name = "bms.report.wizard"
+    _inherit = "bms.report.filter.mixin"
     _description = "BMS Report Wizard"
 
-    report_type = fields.Selection(
-        [
-            ("profit_loss", "Profit / Loss Report"),
-            ("purchase_sales", "Purchase / Sales Report"),
-            ("supplier_customer", "Supplier and Customer Report"),
-            ("stock", "Stock Report"),
-            ("product_purchase", "Products Purchase Report"),
-            ("product_sale_user", "Products Sale Report with Usernames"),
-            ("purchase_payment", "Purchase Payment / Pending Report"),
-            ("sales_payment", "Sales Payment Report"),
-            ("bank", "Bank Report"),
-        ],
-        required=True,
-        default="profit_loss",
+    # Snapshot of the last collection, shared by the PDF and XLSX renderings.
+    payload_key = fields.Char(readonly=True)
+    payload_summary = fields.Text(readonly=True)
+    payload_snapshot = fields.Char(readonly=True)
+    payload_attachment_id = fields.Many2one("ir.attachment", readonly=True, ondelete="set null")
+    preview_page = fields.Integer(default=0, readonly=True)
+    preview_has_next = fields.Boolean(readonly=True)
+    preview_html = fields.Html(sanitize=False, readonly=True)
+    # Summary figures, grouped tables and detail page cursors of the preview session.
+    preview_state = fields.Text(readonly=True)
+    csv_table = fields.Selection(
+        [("sale_lines", "Sales Orders"), ("purchase_lines", "Purchase Orders")],
+        string="CSV Lines",
+        default="sale_lines",
     )
-
-    partner_id = fields.Many2one("res.partner", string="Customer / Supplier")
-    partner_role = fields.Selection(
-        [("all", "All"), ("customer", "Customer"), ("supplier", "Supplier")],
-        default="all",
-        string="Partner Type",
-    )
-    user_id = fields.Many2one("res.users", string="User")
-    date_from = fields.Date(string="Date From")
-    date_to = fields.Date(string="Date To")
-    payment_status = fields.Selection(
-        [
-            ("all", "All"),
-            ("paid", "Paid"),
-            ("partial", "Partially Paid"),
-            ("not_paid", "Not Paid"),
-        ],
-        default="all",
-    )
-    shipping_status = fields.Selection(
-        [("all", "All"), ("done", "Delivered"), ("pending", "Pending")],
-        default="all",
+    csv_gzip = fields.Boolean(string="Compress CSV (gzip)")
+    snapshot_run_id = fields.Many2one(
+        "bms.report.run",
+        string="Latest Snapshot",
+        compute="_compute_snapshot_run_id",
+        help="Most recent scheduled snapshot generated with exactly these filters.",
     )
 
-    xlsx_file = fields.Binary(readonly=True)
-    xlsx_filename = fields.Char(readonly=True)
-
-    def _selection_label(self, field_name, value):
-        return dict(self._fields[field_name].selection).get(value)
+    @api.depends(*REPORT_FILTER_FIELDS)
+    @api.depends_context("allowed_company_ids")
+    def _compute_snapshot_run_id(self):
+        Run = self.env["bms.report.run"]
+        for wizard in self:
+            wizard.snapshot_run_id = Run.search(
+                [
+                    ("filter_key", "=", wizard._filter_key(self.env.companies)),
+                    ("schedule_id", "!=", False),
+                    ("state", "=", "done"),
+                ],
+                order="date_done desc, id desc",
+                limit=1,
+            )
 
     def _date_domain(self, field_name):
         domain = []
@@ -79,17 +118,17 @@ class BmsReportWizard(models.TransientModel):
             domain.append((f"{relation_field}.supplier_rank", ">", 0))
         return domain
 
-    def _shipping_domain(self):
+    def _shipping_domain(self, order_field=None):
         if self.shipping_status == "all":
             return []
-        if "picking_ids" not in self.env["sale.order"]._fields:
-            return []
+        status_field = f"{order_field}.delivery_status" if order_field else "delivery_status"
+        # "Done" is any delivered picking and "pending" any open one, so partially delivered orders match both.
         if self.shipping_status == "done":
-            return [("picking_ids.state", "=", "done")]
-        return [("picking_ids.state", "not in", ("done", "cancel"))]
+            return [(status_field, "in", ("started", "partial", "full"))]
+        return [(status_field, "in", ("pending", "started", "partial"))]
 
     def _base_filters(self):
-        return {
+        filters = {
             "partner": self.partner_id.display_name or "All",
             "partner_role": self._selection_label("partner_role", self.partner_role),
             "payment_status": self._selection_label("payment_status", self.payment_status),
@@ -98,38 +137,402 @@ class BmsReportWizard(models.TransientModel):
             "user": self.user_id.display_name or "All",
             "shipping_status": self._selection_label("shipping_status", self.shipping_status),
         }
+        compare_with = self._compare_label()
+        if compare_with:
+            filters["compare_with"] = compare_with
+        return filters
 
-    def _collect_profit_loss(self):
-        invoice_domain = [("state", "=", "posted"), ("move_type", "in", ("out_invoice", "out_refund"))]
-        bill_domain = [("state", "=", "posted"), ("move_type", "in", ("in_invoice", "in_refund"))]
-        invoice_domain += self._date_domain("invoice_date")
-        bill_domain += self._date_domain("invoice_date")
-        if self.partner_id:
-            invoice_domain.append(("partner_id", "=", self.partner_id.id))
-            bill_domain.append(("partner_id", "=", self.partner_id.id))
-        self._append_partner_role_domain(invoice_domain)
-        self._append_partner_role_domain(bill_domain)
-        invoice_domain += self._payment_status_domain()
-        bill_domain += self._payment_status_domain()
-
-        invoices = self.env["account.move"].search(invoice_domain)
-        bills = self.env["account.move"].search(bill_domain)
-
-        sales_amount = sum(
-            move.amount_untaxed if move.move_type == "out_invoice" else -move.amount_untaxed for move in invoices
+    def _compare_dates(self):
+        """``(date_from, date_to)`` of the comparison period, or None when not comparing."""
+        if self.compare_period == "none" or self.report_type not in COMPARE_REPORT_TYPES:
+            return None
+        if not (self.date_from and self.date_to):
+            raise UserError("Set both Date From and Date To to compare periods.")
+        if self.compare_period == "previous_year":
+            return self.date_from - relativedelta(years=1), self.date_to - relativedelta(years=1)
+        length = self.date_to - self.date_from + timedelta(days=1)
+        return self.date_from - length, self.date_to - length
+
+    def _compare_label(self):
+        if self.compare_period == "none" or self.report_type not in COMPARE_REPORT_TYPES:
+            return False
+        if not (self.date_from and self.date_to):
+            return self._selection_label("compare_period", self.compare_period)
+        compare_from, compare_to = self._compare_dates()
+        return f"{self._selection_label('compare_period', self.compare_period)} ({compare_from} to {compare_to})"
+
+    def _period_domain(self, field_name):
+        """Date domain of the selected or the comparison period (not the gap between them)."""
+        compare_from, compare_to = self._compare_dates()
+        return [
+            "|",
+            "&", (field_name, ">=", self.date_from), (field_name, "<=", self.date_to),
+            "&", (field_name, ">=", compare_from), (field_name, "<=", compare_to),
+        ]
+
+    def _period_sums(self, model_name, domain, date_column, groupby, sum_fields, join=None):
+        """
+        ``{group: (current sums, comparison sums)}`` of ``sum_fields`` over the
+        ``model_name`` records matching ``domain`` (which should span both
+        periods, see ``_period_domain``), grouped by the ``groupby`` columns.
+
+        Both periods are summed in the same grouped pass by conditional
+        aggregation, so a comparison costs one query instead of running the
+        report twice. Columns are read from the ``rec`` alias; ``join`` may add
+        a table providing ``date_column``.
+        """
+        Model = self.env[model_name]
+        compare_from, compare_to = self._compare_dates()
+        periods = [
+            SQL("%s >= %s AND %s < %s::date + 1", SQL(date_column), date_from, SQL(date_column), date_to)
+            for date_from, date_to in ((self.date_from, self.date_to), (compare_from, compare_to))
+        ]
+        group_columns = [SQL.identifier("rec", name) for name in groupby]
+        sums = [
+            SQL("COALESCE(SUM(%s) FILTER (WHERE %s), 0)", SQL.identifier("rec", name), period)
+            for period in periods
+            for name in sum_fields
+        ]
+        self.env.cr.execute(
+            SQL(
+                "SELECT %s FROM %s rec %s WHERE rec.id IN %s %s",
+                SQL(", ").join(group_columns + sums),
+                SQL.identifier(Model._table),
+                join or SQL(),
+                Model._search(domain).subselect(),
+                SQL("GROUP BY %s", SQL(", ").join(group_columns)) if group_columns else SQL(),
+            )
         )
-        purchase_amount = sum(
-            move.amount_untaxed if move.move_type == "in_invoice" else -move.amount_untaxed for move in bills
+        size = len(sum_fields)
+        return {
+            tuple(row[: len(groupby)]): (row[len(groupby): len(groupby) + size], row[len(groupby) + size:])
+            for row in self.env.cr.fetchall()
+        }
+
+    def _change(self, current, compare):
+        """Change from ``compare`` to ``current``; the percentage is None without a base."""
+        delta = current - compare
+        return delta, round(delta / abs(compare) * 100, 2) if compare else None
+
+    def _comparison_lines(self, figures):
+        """Comparison table rows of ``[(label, current, compare)]`` summary figures."""
+        lines = []
+        for label, current, compare in figures:
+            delta, delta_pct = self._change(current, compare)
+            lines.append(
+                {"figure": label, "current": current, "compare": compare, "delta": delta, "delta_pct": delta_pct}
+            )
+        return lines
+
+    def _invoice_domain(self, move_types, date_domain=None):
+        domain = [("state", "=", "posted"), ("move_type", "in", move_types)]
+        domain += self._date_domain("invoice_date") if date_domain is None else date_domain
+        if self.partner_id:
+            domain.append(("partner_id", "=", self.partner_id.id))
+        self._append_partner_role_domain(domain)
+        domain += self._payment_status_domain()
+        return domain
+
+    def _can_read_facts(self):
+        """
+        Daily facts are company-wide totals, without the record rules of the
+        documents: only users who see every invoice anyway may read them.
+        """
+        user = self.env.user
+        return self.env.su or user.has_group("DW_BMS.group_bms_admin") or user.has_group("DW_BMS.group_bms_accounts")
+
+    def _profit_loss_totals(self, shared=None):
+        """Untaxed signed totals per invoice move type."""
+        move_types = ("out_invoice", "out_refund", "in_invoice", "in_refund")
+        if shared is None and self.payment_status == "all" and self.partner_role == "all" and self._can_read_facts():
+            return self._profit_loss_fact_totals(move_types)
+        totals = self._invoice_totals(move_types, shared)
+        return {move_type: sums["amount_untaxed_signed"] for move_type, sums in totals.items()}
+
+    def _profit_loss_fact_totals(self, move_types):
+        """
+        Same scope as the invoice domain, from the pre-aggregated daily facts.
+        Dates of the period with a slice waiting for a refresh are summed from
+        the invoices instead.
+        """
+        Fact = self.env["bms.daily.fact"]
+        domain = [("company_id", "in", self.env.companies.ids)] + self._date_domain("date")
+        pending_dates = Fact._pending_dates(move_types, domain)
+        domain = [("doc_type", "in", move_types), ("date", "not in", pending_dates)] + domain
+        if self.partner_id:
+            domain.append(("partner_id", "=", self.partner_id.id))
+        totals = dict.fromkeys(move_types, 0.0)
+        for group in Fact.read_group(domain, ["amount_untaxed:sum"], ["doc_type"], lazy=False):
+            totals[group["doc_type"]] += group["amount_untaxed"] or 0.0
+        if pending_dates:
+            groups = self.env["account.move"].read_group(
+                self._invoice_domain(move_types, [("invoice_date", "in", pending_dates)]),
+                ["amount_untaxed_signed:sum"],
+                ["move_type"],
+                lazy=False,
+            )
+            for group in groups:
+                totals[group["move_type"]] += group["amount_untaxed_signed"] or 0.0
+        return totals
+
+    def _invoice_totals(self, move_types, shared=None):
+        """
+        ``{move_type: {field: sum}}`` of the signed untaxed amount, total and
+        residual of the filtered invoices, in one grouped query. The export of
+        all reports computes them once and passes them as ``shared``.
+        """
+        if shared is not None:
+            return {move_type: shared[move_type] for move_type in move_types if move_type in shared}
+        fields_to_sum = ["amount_untaxed_signed", "amount_total", "amount_residual"]
+        groups = self.env["account.move"].read_group(
+            self._invoice_domain(move_types),
+            [f"{name}:sum" for name in fields_to_sum],
+            ["move_type"],
+            lazy=False,
         )
+        return {group["move_type"]: {name: group[name] or 0.0 for name in fields_to_sum} for group in groups}
+
+    def _profit_loss_amounts(self, totals):
+        # Signed company-currency amounts: refunds are already negative for
+        # sales and positive for purchases, bills are negative.
+        sales_amount = totals.get("out_invoice", 0.0) + totals.get("out_refund", 0.0)
+        purchase_amount = -(totals.get("in_invoice", 0.0) + totals.get("in_refund", 0.0))
         return {
             "sales_amount": sales_amount,
             "purchase_amount": purchase_amount,
             "profit_loss": sales_amount - purchase_amount,
         }
 
-    def _collect_purchase_sales(self):
-        sale_domain = [("state", "in", ("sale", "done"))] + self._date_domain("date_order")
-        purchase_domain = [("state", "in", ("purchase", "done"))] + self._date_domain("date_order")
+    def _collect_profit_loss(self, datasets=None):
+        if not self._compare_dates():
+            return self._profit_loss_amounts(self._profit_loss_totals(datasets and datasets["invoice_totals"]))
+        move_types = ("out_invoice", "out_refund", "in_invoice", "in_refund")
+        sums = self._period_sums(
+            "account.move",
+            self._invoice_domain(move_types, self._period_domain("invoice_date")),
+            "rec.invoice_date",
+            ["move_type"],
+            ["amount_untaxed_signed"],
+        )
+        current = self._profit_loss_amounts({key[0]: values[0][0] for key, values in sums.items()})
+        compare = self._profit_loss_amounts({key[0]: values[1][0] for key, values in sums.items()})
+        return {
+            **current,
+            "comparison_lines": self._comparison_lines(
+                [
+                    ("Sales Amount", current["sales_amount"], compare["sales_amount"]),
+                    ("Purchase Amount", current["purchase_amount"], compare["purchase_amount"]),
+                    ("Profit / Loss", current["profit_loss"], compare["profit_loss"]),
+                ]
+            ),
+        }
+
+    def _gross_margin_line_domain(self):
+        domain = [
+            ("parent_state", "=", "posted"),
+            ("move_id.move_type", "in", ("out_invoice", "out_refund")),
+            ("display_type", "=", "product"),
+            ("company_id", "in", self.env.companies.ids),
+        ]
+        domain += self._date_domain("move_id.invoice_date")
+        if self.partner_id:
+            domain.append(("move_id.commercial_partner_id", "=", self.partner_id.commercial_partner_id.id))
+        if self.user_id:
+            domain.append(("move_id.invoice_user_id", "=", self.user_id.id))
+        return domain
+
+    def _gross_margin_rows(self, key_expression=None, after=None, limit=None):
+        """
+        ``[(key, revenue, cogs, qty)]`` per margin group: every group, or with
+        ``limit`` the first ``limit`` groups in key order after the key ``after``.
+        ``key_expression`` overrides the grouping (a constant gives the totals).
+
+        Revenue and quantity come from the posted customer invoice and credit
+        note product lines of the period (by invoice date, record rules
+        applied), and each line is costed from its own invoice, so both sides
+        describe the same transactions:
+
+        - the anglo-saxon COGS expense lines of the invoice for its product;
+        - otherwise the average valuation of the deliveries and returns of the
+          invoiced sale order lines;
+        - otherwise the product cost (consumables have no valuation layers).
+        """
+        key_expression = key_expression or MARGIN_GROUP_KEYS[self.margin_group_by or "product"][0]
+        page = SQL("TRUE")
+        if limit is not None:
+            page = SQL(
+                "line_totals.key IN (SELECT key FROM line_totals WHERE key > %s GROUP BY key ORDER BY key LIMIT %s)",
+                -1 if after is None else after,
+                limit,
+            )
+        self.env.flush_all()
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH inv AS (
+                    SELECT aml.id, aml.move_id,
+                           COALESCE(aml.product_id, 0) AS product_id,
+                           COALESCE(%s, 0) AS key,
+                           -aml.balance AS revenue,
+                           CASE WHEN move.move_type = 'out_refund' THEN -1 ELSE 1 END
+                               * aml.quantity / COALESCE(line_uom.factor, 1) * COALESCE(product_uom.factor, 1) AS qty
+                      FROM account_move_line aml
+                      JOIN account_move move ON move.id = aml.move_id
+                 LEFT JOIN product_product product ON product.id = aml.product_id
+                 LEFT JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+                 LEFT JOIN uom_uom line_uom ON line_uom.id = aml.product_uom_id
+                 LEFT JOIN uom_uom product_uom ON product_uom.id = tmpl.uom_id
+                     WHERE aml.id IN %s
+                ), journal_cogs AS (
+                    SELECT cogs.move_id, cogs.product_id, SUM(cogs.balance) AS amount
+                      FROM account_move_line cogs
+                      JOIN account_account account ON account.id = cogs.account_id
+                     WHERE cogs.move_id IN (SELECT move_id FROM inv)
+                       AND cogs.display_type = 'cogs'
+                       AND account.account_type LIKE 'expense%%'
+                  GROUP BY 1, 2
+                ), layer_cost AS (
+                    SELECT rel.invoice_line_id, SUM(-svl.value) / NULLIF(SUM(-svl.quantity), 0) AS unit_cost
+                      FROM sale_order_line_invoice_rel rel
+                      JOIN stock_move sm ON sm.sale_line_id = rel.order_line_id AND sm.state = 'done'
+                      JOIN stock_valuation_layer svl ON svl.stock_move_id = sm.id
+                     WHERE rel.invoice_line_id IN (SELECT id FROM inv)
+                  GROUP BY 1
+                ), journal_by_key AS (
+                    SELECT keys.key, keys.product_id, SUM(journal_cogs.amount) AS amount
+                      FROM journal_cogs
+                      JOIN (SELECT DISTINCT move_id, product_id, key FROM inv) keys
+                        ON keys.move_id = journal_cogs.move_id AND keys.product_id = journal_cogs.product_id
+                  GROUP BY 1, 2
+                ), line_totals AS (
+                    SELECT inv.key, inv.product_id,
+                           SUM(inv.revenue) AS revenue,
+                           SUM(inv.qty) AS qty,
+                           COALESCE(SUM(inv.qty * layer_cost.unit_cost)
+                                    FILTER (WHERE journal_cogs.move_id IS NULL), 0) AS layer_amount,
+                           COALESCE(SUM(inv.qty)
+                                    FILTER (WHERE journal_cogs.move_id IS NULL AND layer_cost.unit_cost IS NULL), 0)
+                               AS uncosted_qty
+                      FROM inv
+                 LEFT JOIN journal_cogs
+                        ON journal_cogs.move_id = inv.move_id AND journal_cogs.product_id = inv.product_id
+                 LEFT JOIN layer_cost ON layer_cost.invoice_line_id = inv.id
+                  GROUP BY 1, 2
+                )
+                SELECT line_totals.key, line_totals.product_id, line_totals.revenue::float, line_totals.qty::float,
+                       (line_totals.layer_amount + COALESCE(journal_by_key.amount, 0))::float,
+                       line_totals.uncosted_qty::float
+                  FROM line_totals
+             LEFT JOIN journal_by_key
+                    ON journal_by_key.key = line_totals.key AND journal_by_key.product_id = line_totals.product_id
+                 WHERE %s
+                """,
+                SQL(key_expression),
+                self.env["account.move.line"]._search(self._gross_margin_line_domain()).subselect(),
+                page,
+            )
+        )
+        rows = self.env.cr.fetchall()
+        uncosted_ids = {product_id for _key, product_id, *_sums, uncosted_qty in rows if product_id and uncosted_qty}
+        costs = {
+            product.id: product.standard_price
+            for product in self.env["product.product"].with_context(active_test=False).browse(uncosted_ids)
+        }
+        totals = {}
+        for key, product_id, revenue, qty, cogs, uncosted_qty in rows:
+            group = totals.setdefault(key, [0.0, 0.0, 0.0])
+            group[0] += revenue
+            group[1] += cogs + uncosted_qty * costs.get(product_id, 0.0)
+            group[2] += qty
+        return [(key, revenue, cogs, qty) for key, (revenue, cogs, qty) in totals.items()]
+
+    def _margin_lines(self, rows):
+        key_model = MARGIN_GROUP_KEYS[self.margin_group_by or "product"][1]
+        names = {
+            record["id"]: record["display_name"]
+            for record in self.env[key_model].with_context(active_test=False).search_read(
+                [("id", "in", [row[0] for row in rows if row[0]])], ["display_name"]
+            )
+        }
+        margin_lines = []
+        for key, revenue, cogs, qty in rows:
+            margin = revenue - cogs
+            margin_lines.append(
+                {
+                    "name": names.get(key, "Undefined"),
+                    "qty": qty,
+                    "revenue": revenue,
+                    "cogs": cogs,
+                    "margin": margin,
+                    "margin_pct": round(margin / revenue * 100, 2) if revenue else 0.0,
+                }
+            )
+        return margin_lines
+
+    def _gross_margin_totals(self, total_revenue, total_cogs):
+        total_margin = total_revenue - total_cogs
+        return {
+            "total_revenue": total_revenue,
+            "total_cogs": total_cogs,
+            "total_margin": total_margin,
+            "total_margin_pct": round(total_margin / total_revenue * 100, 2) if total_revenue else 0.0,
+        }
+
+    def _check_gross_margin_access(self):
+        self.env["account.move.line"].check_access_rights("read")
+        self.env["stock.valuation.layer"].check_access_rights("read")
+
+    def _collect_gross_margin(self):
+        self._check_gross_margin_access()
+        margin_lines = self._margin_lines(self._gross_margin_rows())
+        margin_lines.sort(key=lambda line: line["revenue"], reverse=True)
+        return {
+            "margin_lines": margin_lines,
+            **self._gross_margin_totals(
+                sum(line["revenue"] for line in margin_lines), sum(line["cogs"] for line in margin_lines)
+            ),
+        }
+
+    def _iter_records(self, model_name, domain, field_names):
+        """
+        Yield ``read`` rows of ``model_name`` in its default order, in batches
+        of REPORT_BATCH_SIZE evicted from the cache once read, so detail
+        tables of any length are streamed holding only their ids.
+        """
+        records = self.env[model_name].search(domain)
+        for batch in split_every(REPORT_BATCH_SIZE, records.ids, records.browse):
+            yield from batch.read(field_names)
+            batch.invalidate_recordset()
+
+    def _sum_fields(self, model_name, domain, field_names):
+        groups = self.env[model_name].read_group(domain, [f"{name}:sum" for name in field_names], [])
+        group = groups[0] if groups else {}
+        return {name: group.get(name) or 0.0 for name in field_names}
+
+    def _order_line(self, order):
+        line = {
+            "name": order["name"],
+            "date": order["date_order"].date() if order["date_order"] else False,
+            "partner": order["partner_id"] and order["partner_id"][1] or "",
+            "amount": order["amount_total"],
+        }
+        if "user_id" in order:
+            line["user"] = order["user_id"] and order["user_id"][1] or ""
+        return line
+
+    def _iter_order_lines(self, model_name, domain, with_user=False):
+        field_names = list(ORDER_LINE_FIELDS)
+        if with_user:
+            field_names.append("user_id")
+        for order in self._iter_records(model_name, domain, field_names):
+            yield self._order_line(order)
+
+    def _order_domains(self, date_domain=None):
+        """Domains of the sale and purchase orders of the Purchase / Sales report."""
+        if date_domain is None:
+            date_domain = self._date_domain("date_order")
+        sale_domain = [("state", "in", ("sale", "done"))] + date_domain
+        purchase_domain = [("state", "in", ("purchase", "done"))] + date_domain
         if self.partner_id:
             sale_domain.append(("partner_id", "=", self.partner_id.id))
             purchase_domain.append(("partner_id", "=", self.partner_id.id))
@@ -138,248 +541,1121 @@ class BmsReportWizard(models.TransientModel):
         self._append_partner_role_domain(sale_domain)
         self._append_partner_role_domain(purchase_domain)
         sale_domain += self._shipping_domain()
+        return sale_domain, purchase_domain
 
-        sale_orders = self.env["sale.order"].search(sale_domain)
-        purchase_orders = self.env["purchase.order"].search(purchase_domain)
-        purchase_lines = []
-        for order in purchase_orders:
-            purchase_lines.append(
-                {
-                    "name": order.name,
-                    "date": order.date_order.date() if order.date_order else False,
-                    "partner": order.partner_id.display_name,
-                    "amount": order.amount_total,
-                }
-            )
-        sale_lines = []
-        for order in sale_orders:
-            sale_lines.append(
-                {
-                    "name": order.name,
-                    "date": order.date_order.date() if order.date_order else False,
-                    "partner": order.partner_id.display_name,
-                    "user": order.user_id.display_name or "",
-                    "amount": order.amount_total,
-                }
+    def _order_totals(self):
+        """
+        ``{model: (amount, compare amount)}`` of the filtered sale and purchase
+        orders; the compare amount is None when not comparing.
+        """
+        sale_domain, purchase_domain = self._order_domains()
+        if not self._compare_dates():
+            return {
+                "sale.order": (self._sum_fields("sale.order", sale_domain, ["amount_total"])["amount_total"], None),
+                "purchase.order": (
+                    self._sum_fields("purchase.order", purchase_domain, ["amount_total"])["amount_total"],
+                    None,
+                ),
+            }
+        # Totals of both periods, each in one grouped query over both.
+        totals = {}
+        for model_name, domain in zip(
+            ("sale.order", "purchase.order"), self._order_domains(self._period_domain("date_order"))
+        ):
+            current, compare = self._period_sums(model_name, domain, "rec.date_order", [], ["amount_total"])[()]
+            totals[model_name] = (current[0], compare[0])
+        return totals
+
+    def _collect_purchase_sales(self, datasets=None):
+        sale_domain, purchase_domain = self._order_domains()
+        totals = datasets["order_totals"] if datasets else self._order_totals()
+        (sale_total, sale_compare), (purchase_total, purchase_compare) = (
+            totals["sale.order"],
+            totals["purchase.order"],
+        )
+        payload = {"sale_total": sale_total, "purchase_total": purchase_total}
+        if self._compare_dates():
+            payload["comparison_lines"] = self._comparison_lines(
+                [
+                    ("Total Sales", sale_total, sale_compare),
+                    ("Total Purchases", purchase_total, purchase_compare),
+                ]
             )
+        payload["sale_lines"] = self._iter_order_lines("sale.order", sale_domain, with_user=True)
+        payload["purchase_lines"] = self._iter_order_lines("purchase.order", purchase_domain)
+        return payload
+
+    def _partner_open_balances(self, partner_domain):
+        """
+        ``{(partner_id, account_type): open amount}`` over posted, unreconciled
+        receivable/payable lines of the active companies (the scope of
+        ``partner.credit`` / ``partner.debit``), in one grouped query.
+        """
+        groups = self.env["account.move.line"].read_group(
+            [
+                ("partner_id", "in", self.env["res.partner"]._search(partner_domain)),
+                ("account_type", "in", ("asset_receivable", "liability_payable")),
+                ("reconciled", "=", False),
+                ("parent_state", "=", "posted"),
+                ("company_id", "in", self.env.companies.ids),
+            ],
+            ["amount_residual:sum"],
+            ["partner_id", "account_type"],
+            lazy=False,
+        )
         return {
-            "sale_total": sum(sale_orders.mapped("amount_total")),
-            "purchase_total": sum(purchase_orders.mapped("amount_total")),
-            "sale_lines": sale_lines,
-            "purchase_lines": purchase_lines,
+            (group["partner_id"][0], group["account_type"]): group["amount_residual"] or 0.0
+            for group in groups
+            if group["partner_id"]
         }
 
-    def _collect_supplier_customer(self):
+    def _supplier_customer_partners(self):
+        """``(partners, open balances)`` of the companies listed by the supplier / customer report."""
         partner_domain = [("is_company", "=", True)]
         if self.partner_id:
             partner_domain.append(("id", "=", self.partner_id.id))
-        customers = self.env["res.partner"].search(partner_domain + [("customer_rank", ">", 0)])
-        suppliers = self.env["res.partner"].search(partner_domain + [("supplier_rank", ">", 0)])
         if self.partner_role == "customer":
-            suppliers = self.env["res.partner"]
+            partner_domain.append(("customer_rank", ">", 0))
         elif self.partner_role == "supplier":
-            customers = self.env["res.partner"]
+            partner_domain.append(("supplier_rank", ">", 0))
+        else:
+            partner_domain += ["|", ("customer_rank", ">", 0), ("supplier_rank", ">", 0)]
+        partners = self.env["res.partner"].search_read(
+            partner_domain, ["display_name", "phone", "email", "customer_rank", "supplier_rank"]
+        )
+        return partners, self._partner_open_balances(partner_domain)
+
+    def _collect_supplier_customer(self, datasets=None):
+        partners, balances = datasets["partner_balances"] if datasets else self._supplier_customer_partners()
+        customer_lines, supplier_lines = [], []
+        for partner in partners:
+            line = {"name": partner["display_name"], "phone": partner["phone"] or "", "email": partner["email"] or ""}
+            if partner["customer_rank"] > 0 and self.partner_role != "supplier":
+                customer_lines.append(
+                    dict(line, receivable=balances.get((partner["id"], "asset_receivable"), 0.0))
+                )
+            if partner["supplier_rank"] > 0 and self.partner_role != "customer":
+                supplier_lines.append(
+                    dict(line, payable=-balances.get((partner["id"], "liability_payable"), 0.0))
+                )
+        return {"customer_lines": customer_lines, "supplier_lines": supplier_lines}
+
+    def _stock_qty_by_product(self, model_name, domain, qty_field):
+        groups = self.env[model_name].read_group(
+            domain + [("company_id", "in", self.env.companies.ids), ("product_id.type", "=", "product")],
+            [f"{qty_field}:sum"],
+            ["product_id"],
+            lazy=False,
+        )
+        return {group["product_id"][0]: group[qty_field] or 0.0 for group in groups}
+
+    def _day_end_utc(self, day):
+        """Naive UTC datetime of the midnight ending ``day`` in the user's (else the company's) timezone."""
+        tz = pytz.timezone(self.env.user.tz or self.env.company.partner_id.tz or "UTC")
+        local_end = tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+        return local_end.astimezone(pytz.utc).replace(tzinfo=None)
+
+    def _query_rows(self, query, keys=(), after=None, limit=None):
+        """
+        Rows of the select ``query``; with ``keys`` (expressions over its
+        columns) in their order, after the key values ``after``, at most
+        ``limit`` rows.
+        """
+        self.env.flush_all()
+        if not keys:
+            self.env.cr.execute(query)
+            return self.env.cr.fetchall()
+        keys = SQL(", ").join(SQL(key) for key in keys)
+        self.env.cr.execute(
+            SQL(
+                "SELECT * FROM (%s) query_rows WHERE %s ORDER BY %s LIMIT %s",
+                query,
+                SQL("(%s) > %s", keys, tuple(after)) if after else SQL("TRUE"),
+                keys,
+                limit,
+            )
+        )
+        return self.env.cr.fetchall()
+
+    def _query_totals(self, query, columns):
+        """Sums of ``columns`` over the rows of the select ``query``."""
+        self.env.flush_all()
+        self.env.cr.execute(
+            SQL(
+                "SELECT %s FROM (%s) query_rows",
+                SQL(", ").join(SQL("COALESCE(SUM(%s), 0)", SQL.identifier(column)) for column in columns),
+                query,
+            )
+        )
+        return self.env.cr.fetchone()
+
+    def _stock_at_date_query(self):
+        """
+        Select of ``(product_id, qty, value)`` of storable products at the end
+        of ``stock_date``, grouped in one query: quantities from the done moves
+        entering or leaving internal locations, values from the valuation
+        layers, both read through date-bounded index scans.
+        """
+        company_ids = tuple(self.env.companies.ids)
+        return SQL(
+            """
+            WITH moves AS (
+                SELECT sm.product_id,
+                       SUM(CASE WHEN dest.usage = 'internal' THEN sm.product_qty ELSE -sm.product_qty END) AS qty
+                  FROM stock_move sm
+                  JOIN stock_location src ON src.id = sm.location_id
+                  JOIN stock_location dest ON dest.id = sm.location_dest_id
+                 WHERE sm.state = 'done'
+                   AND sm.date < %(end)s
+                   AND sm.company_id IN %(company_ids)s
+                   AND (src.usage = 'internal') != (dest.usage = 'internal')
+              GROUP BY sm.product_id
+            ), layers AS (
+                SELECT svl.product_id, SUM(svl.value) AS value
+                  FROM stock_valuation_layer svl
+                 WHERE svl.create_date < %(end)s
+                   AND svl.company_id IN %(company_ids)s
+              GROUP BY svl.product_id
+            )
+            SELECT product.id AS product_id,
+                   COALESCE(moves.qty, 0)::float AS qty,
+                   COALESCE(layers.value, 0)::float AS value
+              FROM moves
+         FULL JOIN layers ON layers.product_id = moves.product_id
+              JOIN product_product product ON product.id = COALESCE(moves.product_id, layers.product_id)
+              JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+             WHERE tmpl.type = 'product'
+               AND (COALESCE(moves.qty, 0) != 0 OR COALESCE(layers.value, 0) != 0)
+            """,
+            # Move dates and layer creation dates are stored in UTC.
+            end=self._day_end_utc(self.stock_date),
+            company_ids=company_ids,
+        )
+
+    def _stock_at_date_lines(self, rows):
+        names = {
+            product["id"]: product["display_name"]
+            for product in self.env["product.product"].with_context(active_test=False).search_read(
+                [("id", "in", [row[0] for row in rows])], ["display_name"]
+            )
+        }
+        return [
+            {
+                "product": names.get(product_id, "Undefined"),
+                "qty_available": qty,
+                "unit_cost": value / qty if qty else 0.0,
+                "stock_value": value,
+            }
+            for product_id, qty, value in rows
+        ]
+
+    def _check_stock_at_date_access(self):
+        self.env["stock.move"].check_access_rights("read")
+        self.env["stock.valuation.layer"].check_access_rights("read")
+
+    def _collect_stock_at_date(self):
+        self._check_stock_at_date_access()
+        stock_lines = self._stock_at_date_lines(self._query_rows(self._stock_at_date_query()))
+        stock_lines.sort(key=lambda line: line["product"])
         return {
-            "customer_lines": [
-                {
-                    "name": partner.display_name,
-                    "phone": partner.phone or "",
-                    "email": partner.email or "",
-                    "receivable": partner.credit,
-                }
-                for partner in customers
-            ],
-            "supplier_lines": [
-                {
-                    "name": partner.display_name,
-                    "phone": partner.phone or "",
-                    "email": partner.email or "",
-                    "payable": partner.debit,
-                }
-                for partner in suppliers
-            ],
+            "stock_date": self.stock_date,
+            "stock_lines": stock_lines,
+            "stock_total_qty": sum(line["qty_available"] for line in stock_lines),
+            "stock_total_value": sum(line["stock_value"] for line in stock_lines),
         }
 
-    def _collect_stock(self):
-        products = self.env["product.product"].search([("type", "=", "product")])
+    def _stock_products_domain(self):
+        """Storable products with stock on hand or pending moves in the active companies."""
+        companies = ("company_id", "in", self.env.companies.ids)
+        return [
+            ("type", "=", "product"),
+            "|",
+            ("stock_quant_ids", "any", [("location_id.usage", "=", "internal"), companies]),
+            ("stock_move_ids", "any", [("state", "in", STOCK_PENDING_STATES), companies]),
+        ]
+
+    def _current_stock_lines(self, product_ids=None):
+        """
+        Stock lines of every product, or of ``product_ids``: same location
+        scope as qty_available / virtual_available, computed for all of them
+        at once instead of per product.
+        """
+        scope = [] if product_ids is None else [("product_id", "in", product_ids)]
+        on_hand = self._stock_qty_by_product(
+            "stock.quant", scope + [("location_id.usage", "=", "internal")], "quantity"
+        )
+        incoming = self._stock_qty_by_product(
+            "stock.move",
+            scope + [
+                ("state", "in", STOCK_PENDING_STATES),
+                ("location_dest_id.usage", "=", "internal"),
+                ("location_id.usage", "!=", "internal"),
+            ],
+            "product_qty",
+        )
+        outgoing = self._stock_qty_by_product(
+            "stock.move",
+            scope + [
+                ("state", "in", STOCK_PENDING_STATES),
+                ("location_id.usage", "=", "internal"),
+                ("location_dest_id.usage", "!=", "internal"),
+            ],
+            "product_qty",
+        )
+        stocked_ids = set(on_hand) | set(incoming) | set(outgoing)
+        products = self.env["product.product"].search_read(
+            [("id", "in", list(stocked_ids))], ["display_name", "standard_price"]
+        )
         stock_lines = []
         for product in products:
-            if not product.qty_available and not product.virtual_available:
+            qty_available = on_hand.get(product["id"], 0.0)
+            forecast_qty = qty_available + incoming.get(product["id"], 0.0) - outgoing.get(product["id"], 0.0)
+            if not qty_available and not forecast_qty:
                 continue
             stock_lines.append(
                 {
-                    "product": product.display_name,
-                    "qty_available": product.qty_available,
-                    "forecast_qty": product.virtual_available,
-                    "unit_cost": product.standard_price,
-                    "stock_value": product.qty_available * product.standard_price,
+                    "product": product["display_name"],
+                    "qty_available": qty_available,
+                    "forecast_qty": forecast_qty,
+                    "unit_cost": product["standard_price"],
+                    "stock_value": qty_available * product["standard_price"],
                 }
             )
+        return stock_lines
+
+    def _current_stock_totals(self):
+        """``(qty, value)`` on hand of all products, without building their lines."""
+        on_hand = self._stock_qty_by_product("stock.quant", [("location_id.usage", "=", "internal")], "quantity")
+        prices = {
+            product["id"]: product["standard_price"]
+            for product in self.env["product.product"].search_read([("id", "in", list(on_hand))], ["standard_price"])
+        }
+        return (
+            sum(qty for product_id, qty in on_hand.items() if product_id in prices),
+            sum(qty * prices[product_id] for product_id, qty in on_hand.items() if product_id in prices),
+        )
+
+    def _collect_stock(self):
+        if self.stock_date:
+            return self._collect_stock_at_date()
+        stock_lines = self._current_stock_lines()
         return {
             "stock_lines": stock_lines,
             "stock_total_qty": sum(line["qty_available"] for line in stock_lines),
             "stock_total_value": sum(line["stock_value"] for line in stock_lines),
         }
 
-    def _collect_product_purchase(self):
-        line_domain = [("order_id.state", "in", ("purchase", "done"))] + self._date_domain("order_id.date_order")
+    def _stock_location_query(self):
+        """
+        Select of ``(location_id, product_id, qty, value)``: the storage
+        location and on-hand quantity of the storable products in internal
+        locations, in one aggregated query: quant totals joined with the
+        template's storage location, valued from the stock valuation layers.
+        """
+        return SQL(
+            """
+            WITH on_hand AS (
+                SELECT quant.product_id, SUM(quant.quantity) AS qty
+                  FROM stock_quant quant
+                  JOIN stock_location location ON location.id = quant.location_id
+                 WHERE location.usage = 'internal'
+                   AND quant.company_id IN %(company_ids)s
+              GROUP BY quant.product_id
+            ), valuation AS (
+                SELECT svl.product_id, SUM(svl.value) AS value
+                  FROM stock_valuation_layer svl
+                 WHERE svl.company_id IN %(company_ids)s
+                   AND svl.product_id IN (SELECT product_id FROM on_hand)
+              GROUP BY svl.product_id
+            )
+            SELECT tmpl.product_storage_location_id AS location_id, on_hand.product_id,
+                   on_hand.qty::float AS qty, COALESCE(valuation.value, 0)::float AS value
+              FROM on_hand
+              JOIN product_product product ON product.id = on_hand.product_id
+              JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+         LEFT JOIN valuation ON valuation.product_id = on_hand.product_id
+             WHERE tmpl.type = 'product'
+               AND on_hand.qty != 0
+            """,
+            company_ids=tuple(self.env.companies.ids),
+        )
+
+    def _storage_location_names(self, location_ids):
+        return {
+            location["id"]: location["name"]
+            for location in self.env["dw.product.storage.location"].with_context(active_test=False).search_read(
+                [("id", "in", [location_id for location_id in location_ids if location_id])], ["name"]
+            )
+        }
+
+    def _stock_location_product_lines(self, rows):
+        """``[(location_id, line)]`` of the ``_stock_location_query`` rows."""
+        location_names = self._storage_location_names([row[0] for row in rows])
+        product_names = {
+            product["id"]: product["display_name"]
+            for product in self.env["product.product"].with_context(active_test=False).search_read(
+                [("id", "in", [row[1] for row in rows])], ["display_name"]
+            )
+        }
+        return [
+            (
+                location_id,
+                {
+                    "location": location_names.get(location_id, "Unassigned"),
+                    "product": product_names.get(product_id, "Undefined"),
+                    "qty": qty,
+                    "unit_cost": value / qty if qty else 0.0,
+                    "value": value,
+                },
+            )
+            for location_id, product_id, qty, value in rows
+        ]
+
+    def _check_stock_location_access(self):
+        self.env["stock.quant"].check_access_rights("read")
+        self.env["stock.valuation.layer"].check_access_rights("read")
+
+    def _collect_stock_location(self):
+        self._check_stock_location_access()
+        lines = self._stock_location_product_lines(self._query_rows(self._stock_location_query()))
+        # Bins by name (the id keeps same-named bins apart), products without a bin last.
+        lines.sort(
+            key=lambda item: (not item[0], item[1]["location"], item[0] or 0, item[1]["product"])
+        )
+        location_product_lines = [line for _location_id, line in lines]
+        location_lines = []
+        last_location_id = False
+        for location_id, line in lines:
+            if not location_lines or location_id != last_location_id:
+                location_lines.append({"location": line["location"], "items": 0, "qty": 0.0, "value": 0.0})
+                last_location_id = location_id
+            location_lines[-1]["items"] += 1
+            location_lines[-1]["qty"] += line["qty"]
+            location_lines[-1]["value"] += line["value"]
+        return {
+            "location_lines": location_lines,
+            "location_product_lines": location_product_lines,
+            "stock_total_qty": sum(line["qty"] for line in location_lines),
+            "stock_total_value": sum(line["value"] for line in location_lines),
+        }
+
+    def _product_period_lines(self, model_name, domain, groupby, qty_field):
+        """
+        Product lines of both periods: quantities and amounts of the selected
+        dates, the comparison amount and the change, from one grouped query.
+        ``groupby`` maps the grouped fields to the line keys of their names.
+        """
+        Model = self.env[model_name]
+        order_table = self.env[Model._fields["order_id"].comodel_name]._table
+        sums = self._period_sums(
+            model_name,
+            domain + self._period_domain("order_id.date_order"),
+            "ord.date_order",
+            list(groupby),
+            [qty_field, "price_total"],
+            join=SQL("JOIN %s ord ON ord.id = rec.order_id", SQL.identifier(order_table)),
+        )
+        names = {}
+        for position, field_name in enumerate(groupby):
+            Comodel = self.env[Model._fields[field_name].comodel_name]
+            ids = [key[position] for key in sums if key[position]]
+            names[field_name] = {
+                record["id"]: record["display_name"]
+                for record in Comodel.with_context(active_test=False).search_read([("id", "in", ids)], ["display_name"])
+            }
+        lines = []
+        for key, ((qty, amount), (compare_qty, compare_amount)) in sums.items():
+            delta, delta_pct = self._change(amount, compare_amount)
+            lines.append(
+                {
+                    **{
+                        line_key: names[field_name].get(key[position], "Undefined")
+                        for position, (field_name, line_key) in enumerate(groupby.items())
+                    },
+                    "qty": qty,
+                    "amount": amount,
+                    "compare_qty": compare_qty,
+                    "compare_amount": compare_amount,
+                    "delta": delta,
+                    "delta_pct": delta_pct,
+                }
+            )
+        return sorted(lines, key=lambda line: line["amount"], reverse=True)
+
+    def _product_purchase_lines(self):
+        line_domain = [("order_id.state", "in", ("purchase", "done"))]
         if self.partner_id:
             line_domain.append(("order_id.partner_id", "=", self.partner_id.id))
         if self.user_id:
             line_domain.append(("order_id.user_id", "=", self.user_id.id))
         self._append_partner_role_domain(line_domain, "order_id.partner_id")
-        lines = self.env["purchase.order.line"].search(line_domain)
-        grouped = defaultdict(lambda: {"qty": 0.0, "amount": 0.0})
-        for line in lines:
-            key = line.product_id.display_name
-            grouped[key]["qty"] += line.product_qty
-            grouped[key]["amount"] += line.price_total
-        return {
-            "product_lines": [
-                {"product": product, "qty": values["qty"], "amount": values["amount"]}
-                for product, values in grouped.items()
-            ]
-        }
+        if self._compare_dates():
+            return self._product_period_lines(
+                "purchase.order.line", line_domain, {"product_id": "product"}, "product_qty"
+            )
+        groups = self.env["purchase.order.line"].read_group(
+            line_domain + self._date_domain("order_id.date_order"),
+            ["product_qty:sum", "price_total:sum"],
+            ["product_id"],
+            lazy=False,
+        )
+        return [
+            {
+                "product": group["product_id"] and group["product_id"][1] or "Undefined",
+                "qty": group["product_qty"] or 0.0,
+                "amount": group["price_total"] or 0.0,
+            }
+            for group in groups
+        ]
+
+    def _collect_product_purchase(self, datasets=None):
+        return {"product_lines": datasets["product_purchase_lines"] if datasets else self._product_purchase_lines()}
 
-    def _collect_product_sale_user(self):
-        line_domain = [("order_id.state", "in", ("sale", "done"))] + self._date_domain("order_id.date_order")
+    def _product_sale_user_lines(self):
+        line_domain = [("order_id.state", "in", ("sale", "done"))]
         if self.partner_id:
             line_domain.append(("order_id.partner_id", "=", self.partner_id.id))
         if self.user_id:
             line_domain.append(("order_id.user_id", "=", self.user_id.id))
         self._append_partner_role_domain(line_domain, "order_id.partner_id")
-        line_domain += self._shipping_domain()
-        lines = self.env["sale.order.line"].search(line_domain)
-        grouped = defaultdict(lambda: {"qty": 0.0, "amount": 0.0})
-        for line in lines:
-            key = (line.product_id.display_name, line.order_id.user_id.display_name or "Undefined")
-            grouped[key]["qty"] += line.product_uom_qty
-            grouped[key]["amount"] += line.price_total
+        line_domain += self._shipping_domain("order_id")
+        # salesman_id is the stored copy of order_id.user_id, so the database can group on it.
+        if self._compare_dates():
+            return self._product_period_lines(
+                "sale.order.line",
+                line_domain,
+                {"product_id": "product", "salesman_id": "user"},
+                "product_uom_qty",
+            )
+        groups = self.env["sale.order.line"].read_group(
+            line_domain + self._date_domain("order_id.date_order"),
+            ["product_uom_qty:sum", "price_total:sum"],
+            ["product_id", "salesman_id"],
+            lazy=False,
+        )
+        return [
+            {
+                "product": group["product_id"] and group["product_id"][1] or "Undefined",
+                "user": group["salesman_id"] and group["salesman_id"][1] or "Undefined",
+                "qty": group["product_uom_qty"] or 0.0,
+                "amount": group["price_total"] or 0.0,
+            }
+            for group in groups
+        ]
+
+    def _collect_product_sale_user(self, datasets=None):
         return {
-            "product_user_lines": [
-                {
-                    "product": product,
-                    "user": user,
-                    "qty": values["qty"],
-                    "amount": values["amount"],
-                }
-                for (product, user), values in grouped.items()
-            ]
+            "product_user_lines": datasets["product_sale_user_lines"] if datasets else self._product_sale_user_lines()
         }
 
-    def _collect_purchase_payment(self):
-        domain = [("state", "=", "posted"), ("move_type", "in", ("in_invoice", "in_refund"))]
-        domain += self._date_domain("invoice_date")
-        if self.partner_id:
-            domain.append(("partner_id", "=", self.partner_id.id))
-        self._append_partner_role_domain(domain)
-        domain += self._payment_status_domain()
-        moves = self.env["account.move"].search(domain)
-        lines = []
-        total_paid = 0.0
-        total_pending = 0.0
-        for move in moves:
-            paid_amount = move.amount_total - move.amount_residual
-            total_paid += paid_amount
-            total_pending += move.amount_residual
-            lines.append(
+    def _payment_line(self, move):
+        return {
+            "name": move["name"],
+            "date": move["invoice_date"],
+            "partner": move["partner_id"] and move["partner_id"][1] or "",
+            "total": move["amount_total"],
+            "paid": move["amount_total"] - move["amount_residual"],
+            "pending": move["amount_residual"],
+            "payment_state": move["payment_state"],
+        }
+
+    def _iter_payment_lines(self, domain):
+        for move in self._iter_records("account.move", domain, PAYMENT_LINE_FIELDS):
+            yield self._payment_line(move)
+
+    def _payment_ageing(self, report_types):
+        """
+        ``{report type: ageing lines}`` of the payment ``report_types``: open
+        amounts per partner bucketed by days past the due date (invoice date
+        when there is none), in company currency, in one grouped query over
+        their invoices. Bills carry negative signed amounts and supplier
+        refunds positive ones, so purchase residuals are negated into
+        positive amounts owed.
+        """
+        purchase_types = PAYMENT_MOVE_TYPES["purchase_payment"]
+        move_types = [move_type for report_type in report_types for move_type in PAYMENT_MOVE_TYPES[report_type]]
+        moves = self.env["account.move"]._search(self._invoice_domain(move_types))
+        self.env.cr.execute(
+            SQL(
+                """
+                SELECT purchase, partner_id,
+                       SUM(amount) FILTER (WHERE age <= 30),
+                       SUM(amount) FILTER (WHERE age BETWEEN 31 AND 60),
+                       SUM(amount) FILTER (WHERE age BETWEEN 61 AND 90),
+                       SUM(amount) FILTER (WHERE age > 90),
+                       SUM(amount)
+                  FROM (
+                        SELECT m.move_type IN %(purchase_types)s AS purchase,
+                               m.partner_id,
+                               CASE WHEN m.move_type IN %(purchase_types)s THEN -1 ELSE 1 END
+                                   * m.amount_residual_signed AS amount,
+                               %(today)s - COALESCE(m.invoice_date_due, m.invoice_date) AS age
+                          FROM account_move m
+                         WHERE m.id IN %(moves)s
+                           AND m.amount_residual_signed != 0
+                       ) open_moves
+              GROUP BY purchase, partner_id
+                """,
+                purchase_types=purchase_types,
+                today=fields.Date.context_today(self),
+                moves=moves.subselect(),
+            )
+        )
+        rows = self.env.cr.fetchall()
+        names = {
+            partner["id"]: partner["display_name"]
+            for partner in self.env["res.partner"].search_read(
+                [("id", "in", [row[1] for row in rows if row[1]])], ["display_name"]
+            )
+        }
+        ageing = {report_type: [] for report_type in report_types}
+        for purchase, partner_id, days_0_30, days_31_60, days_61_90, days_90_plus, total in rows:
+            ageing["purchase_payment" if purchase else "sales_payment"].append(
                 {
-                    "name": move.name,
-                    "date": move.invoice_date,
-                    "partner": move.partner_id.display_name,
-                    "total": move.amount_total,
-                    "paid": paid_amount,
-                    "pending": move.amount_residual,
-                    "payment_state": move.payment_state,
+                    "partner": names.get(partner_id, "Undefined"),
+                    "days_0_30": days_0_30 or 0.0,
+                    "days_31_60": days_31_60 or 0.0,
+                    "days_61_90": days_61_90 or 0.0,
+                    "days_90_plus": days_90_plus or 0.0,
+                    "total": total or 0.0,
                 }
             )
-        return {"payment_lines": lines, "total_paid": total_paid, "total_pending": total_pending}
+        return {
+            report_type: sorted(lines, key=lambda line: line["total"], reverse=True)
+            for report_type, lines in ageing.items()
+        }
 
-    def _collect_sales_payment(self):
-        domain = [("state", "=", "posted"), ("move_type", "in", ("out_invoice", "out_refund"))]
-        domain += self._date_domain("invoice_date")
-        if self.partner_id:
-            domain.append(("partner_id", "=", self.partner_id.id))
-        self._append_partner_role_domain(domain)
-        domain += self._payment_status_domain()
-        moves = self.env["account.move"].search(domain)
-        lines = []
-        total_paid = 0.0
-        total_pending = 0.0
-        for move in moves:
-            paid_amount = move.amount_total - move.amount_residual
-            total_paid += paid_amount
-            total_pending += move.amount_residual
-            lines.append(
-                {
-                    "name": move.name,
-                    "date": move.invoice_date,
-                    "partner": move.partner_id.display_name,
-                    "total": move.amount_total,
-                    "paid": paid_amount,
-                    "pending": move.amount_residual,
-                    "payment_state": move.payment_state,
-                }
+    def _collect_invoice_payments(self, datasets=None):
+        move_types = PAYMENT_MOVE_TYPES[self.report_type]
+        domain = self._invoice_domain(move_types)
+        totals = self._invoice_totals(move_types, datasets and datasets["invoice_totals"]).values()
+        ageing = datasets["payment_ageing"] if datasets else self._payment_ageing([self.report_type])
+        total_amount = sum(sums["amount_total"] for sums in totals)
+        total_pending = sum(sums["amount_residual"] for sums in totals)
+        return {
+            "payment_lines": self._iter_payment_lines(domain),
+            "ageing_lines": ageing[self.report_type],
+            "total_paid": total_amount - total_pending,
+            "total_pending": total_pending,
+        }
+
+    def _keyset_domain(self, cursor, date_field=None):
+        """Records after ``cursor``: the last id read, or the last ``(date, id)`` in ``date_field`` order."""
+        if cursor is None:
+            return []
+        if not date_field:
+            return [("id", ">", cursor)]
+        last_date, last_id = cursor
+        return ["|", (date_field, ">", last_date), "&", (date_field, "=", last_date), ("id", ">", last_id)]
+
+    def _iter_records_by_date(self, model_name, domain, field_names, date_field="date"):
+        """
+        Like :meth:`_iter_records`, in (``date_field``, id) order: each batch
+        resumes after the last (date, id) seen, so no OFFSET scan is needed
+        however deep the listing goes.
+        """
+        Model = self.env[model_name]
+        keyset = []
+        while True:
+            rows = Model.search_read(
+                domain + keyset, field_names, order=f"{date_field}, id", limit=REPORT_BATCH_SIZE
             )
-        return {"payment_lines": lines, "total_paid": total_paid, "total_pending": total_pending}
+            yield from rows
+            if len(rows) < REPORT_BATCH_SIZE:
+                return
+            keyset = self._keyset_domain((rows[-1][date_field], rows[-1]["id"]), date_field)
+            Model.browse([row["id"] for row in rows]).invalidate_recordset()
+
+    def _bank_detail_line(self, payment):
+        return {
+            "date": payment["date"],
+            "name": payment["name"],
+            "bank": payment["journal_id"] and payment["journal_id"][1] or "Undefined",
+            "partner": payment["partner_id"] and payment["partner_id"][1] or "",
+            "amount": payment["amount"],
+        }
 
-    def _collect_bank(self):
+    def _iter_bank_detail_lines(self, domain):
+        for payment in self._iter_records_by_date("account.payment", domain, BANK_DETAIL_FIELDS):
+            yield self._bank_detail_line(payment)
+
+    def _bank_domain(self):
         domain = [("state", "=", "posted")] + self._date_domain("date")
         if self.partner_id:
             domain.append(("partner_id", "=", self.partner_id.id))
         if self.user_id:
             domain.append(("create_uid", "=", self.user_id.id))
-        payments = self.env["account.payment"].search(domain)
-        bank_summary = defaultdict(float)
-        bank_detail = []
-        for payment in payments:
-            bank_name = payment.journal_id.display_name or "Undefined"
-            bank_summary[bank_name] += payment.amount
-            bank_detail.append(
+        return domain
+
+    def _bank_groups(self):
+        groupby = ["journal_id", "date:month"] if self.bank_group_by_month else ["journal_id"]
+        return self.env["account.payment"].read_group(self._bank_domain(), ["amount:sum"], groupby, lazy=False)
+
+    def _collect_bank(self, datasets=None):
+        groups = datasets["bank_groups"] if datasets else self._bank_groups()
+        return {
+            "bank_lines": [
                 {
-                    "date": payment.date,
-                    "name": payment.name,
-                    "bank": bank_name,
-                    "partner": payment.partner_id.display_name,
-                    "amount": payment.amount,
+                    "bank": group["journal_id"] and group["journal_id"][1] or "Undefined",
+                    "month": group.get("date:month") or "",
+                    "amount": group["amount"] or 0.0,
                 }
-            )
-        return {
-            "bank_lines": [{"bank": bank, "amount": amount} for bank, amount in bank_summary.items()],
-            "bank_detail_lines": bank_detail,
+                for group in groups
+            ],
+            "bank_detail_lines": self._iter_bank_detail_lines(self._bank_domain()),
         }
 
-    def _collect_data(self):
+    def _detail_sources(self):
+        """
+        ``{table: (model, domain, field_names, date_field, make_line)}`` of the
+        detail tables of the selected report that are read record by record,
+        in (``date_field``, id) order or id order when ``date_field`` is None.
+        """
+        self.ensure_one()
+        if self.report_type == "purchase_sales":
+            sale_domain, purchase_domain = self._order_domains()
+            return {
+                "sale_lines": ("sale.order", sale_domain, ORDER_LINE_FIELDS + ["user_id"], None, self._order_line),
+                "purchase_lines": ("purchase.order", purchase_domain, ORDER_LINE_FIELDS, None, self._order_line),
+            }
+        if self.report_type in PAYMENT_MOVE_TYPES:
+            domain = self._invoice_domain(PAYMENT_MOVE_TYPES[self.report_type])
+            return {"payment_lines": ("account.move", domain, PAYMENT_LINE_FIELDS, None, self._payment_line)}
+        if self.report_type == "bank":
+            return {
+                "bank_detail_lines": (
+                    "account.payment",
+                    self._bank_domain(),
+                    BANK_DETAIL_FIELDS,
+                    "date",
+                    self._bank_detail_line,
+                )
+            }
+        return {}
+
+    def _page(self, rows, limit, key):
+        """The first ``limit`` of ``rows`` and the ``key`` of the last one, or None when no row follows."""
+        if len(rows) > limit:
+            return rows[:limit], key(rows[limit - 1])
+        return rows, None
+
+    def _grouped_sources(self):
+        """
+        ``{table: page(after, limit)}`` of the grouped tables of the selected
+        report that are paged from the database; ``page`` returns the lines
+        after the cursor ``after`` (None: from the start) and the cursor of the
+        next page, None on the last one. Rows are in key (id) order.
+        """
         self.ensure_one()
-        payload = {}
-        title = self._selection_label("report_type", self.report_type)
+        if self.report_type == "stock" and self.stock_date:
+            self._check_stock_at_date_access()
+            query = self._stock_at_date_query()
+
+            def stock_at_date_page(after, limit):
+                rows, after = self._page(
+                    self._query_rows(query, ["product_id"], after, limit + 1), limit, lambda row: [row[0]]
+                )
+                return self._stock_at_date_lines(rows), after
+
+            return {"stock_lines": stock_at_date_page}
+        if self.report_type == "stock":
+            Product = self.env["product.product"]
+
+            def stock_page(after, limit):
+                domain = self._stock_products_domain() + ([("id", ">", after)] if after else [])
+                product_ids, after = self._page(
+                    Product.search(domain, order="id", limit=limit + 1).ids, limit, lambda product_id: product_id
+                )
+                return self._current_stock_lines(product_ids), after
+
+            return {"stock_lines": stock_page}
+        if self.report_type == "stock_location":
+            self._check_stock_location_access()
+            query = self._stock_location_query()
+            location_keys = ["location_id IS NULL", "COALESCE(location_id, 0)"]
+            summary = SQL(
+                "SELECT location_id, COUNT(*) AS items, SUM(qty) AS qty, SUM(value) AS value"
+                " FROM (%s) product_rows GROUP BY location_id",
+                query,
+            )
+
+            def location_page(after, limit):
+                rows, after = self._page(
+                    self._query_rows(summary, location_keys, after, limit + 1),
+                    limit,
+                    lambda row: [row[0] is None, row[0] or 0],
+                )
+                names = self._storage_location_names([row[0] for row in rows])
+                lines = [
+                    {"location": names.get(location_id, "Unassigned"), "items": items, "qty": qty, "value": value}
+                    for location_id, items, qty, value in rows
+                ]
+                return lines, after
+
+            def location_product_page(after, limit):
+                rows, after = self._page(
+                    self._query_rows(query, location_keys + ["product_id"], after, limit + 1),
+                    limit,
+                    lambda row: [row[0] is None, row[0] or 0, row[1]],
+                )
+                return [line for _location_id, line in self._stock_location_product_lines(rows)], after
+
+            return {"location_lines": location_page, "location_product_lines": location_product_page}
+        if self.report_type == "gross_margin":
+            self._check_gross_margin_access()
+
+            def margin_page(after, limit):
+                rows, after = self._page(
+                    sorted(self._gross_margin_rows(after=after, limit=limit + 1)), limit, lambda row: row[0]
+                )
+                return self._margin_lines(rows), after
+
+            return {"margin_lines": margin_page}
+        return {}
+
+    def _preview_figures(self):
+        """Figures of the reports paged by :meth:`_grouped_sources`, from aggregate queries only."""
+        if self.report_type == "stock":
+            if self.stock_date:
+                qty, value = self._query_totals(self._stock_at_date_query(), ["qty", "value"])
+                return {"stock_date": self.stock_date, "stock_total_qty": qty, "stock_total_value": value}
+            qty, value = self._current_stock_totals()
+            return {"stock_total_qty": qty, "stock_total_value": value}
+        if self.report_type == "stock_location":
+            qty, value = self._query_totals(self._stock_location_query(), ["qty", "value"])
+            return {"stock_total_qty": qty, "stock_total_value": value}
+        if self.report_type == "gross_margin":
+            # A constant key groups every line into one total.
+            totals = self._gross_margin_rows(key_expression="0")
+            return self._gross_margin_totals(*(totals[0][1:3] if totals else (0.0, 0.0)))
+        return {}
+
+    def _csv_tables(self):
+        """
+        ``{table: (header, select, keys)}`` of the detail lines the selected
+        report can export as CSV. ``select`` selects plain columns, then the
+        ``keys`` columns, over the ids matched by the report domain (record
+        rules included); :meth:`_csv_chunk` pages it on ``keys``.
+        """
+        self.ensure_one()
+        partner_name = "COALESCE(partner.complete_name, '')"
+        if self.report_type == "purchase_sales":
+            sale_domain, purchase_domain = self._order_domains()
+            return {
+                "sale_lines": (
+                    ["Sale Order", "Date", "Customer", "User", "Amount"],
+                    SQL(
+                        f"""
+                        SELECT doc.name, doc.date_order::date, {partner_name}, COALESCE(salesman.name, ''),
+                               doc.amount_total, doc.id
+                          FROM sale_order doc
+                     LEFT JOIN res_partner partner ON partner.id = doc.partner_id
+                     LEFT JOIN res_users users ON users.id = doc.user_id
+                     LEFT JOIN res_partner salesman ON salesman.id = users.partner_id
+                         WHERE doc.id IN %s
+                        """,
+                        self.env["sale.order"]._search(sale_domain).subselect(),
+                    ),
+                    [SQL("doc.id")],
+                ),
+                "purchase_lines": (
+                    ["Purchase Order", "Date", "Supplier", "Amount"],
+                    SQL(
+                        f"""
+                        SELECT doc.name, doc.date_order::date, {partner_name}, doc.amount_total, doc.id
+                          FROM purchase_order doc
+                     LEFT JOIN res_partner partner ON partner.id = doc.partner_id
+                         WHERE doc.id IN %s
+                        """,
+                        self.env["purchase.order"]._search(purchase_domain).subselect(),
+                    ),
+                    [SQL("doc.id")],
+                ),
+            }
+        if self.report_type in PAYMENT_MOVE_TYPES:
+            domain = self._invoice_domain(PAYMENT_MOVE_TYPES[self.report_type])
+            return {
+                "payment_lines": (
+                    ["Reference", "Date", "Partner", "Total", "Paid", "Pending", "Payment State"],
+                    SQL(
+                        f"""
+                        SELECT doc.name, doc.invoice_date, {partner_name}, doc.amount_total,
+                               doc.amount_total - doc.amount_residual, doc.amount_residual, doc.payment_state, doc.id
+                          FROM account_move doc
+                     LEFT JOIN res_partner partner ON partner.id = doc.partner_id
+                         WHERE doc.id IN %s
+                        """,
+                        self.env["account.move"]._search(domain).subselect(),
+                    ),
+                    [SQL("doc.id")],
+                ),
+            }
+        if self.report_type == "bank":
+            return {
+                "bank_detail_lines": (
+                    ["Date", "Payment", "Bank", "Partner", "Amount"],
+                    SQL(
+                        f"""
+                        SELECT move.date, move.name, COALESCE(journal.name->>%s, journal.name->>'en_US'),
+                               {partner_name}, doc.amount, move.date, doc.id
+                          FROM account_payment doc
+                          JOIN account_move move ON move.id = doc.move_id
+                          JOIN account_journal journal ON journal.id = doc.journal_id
+                     LEFT JOIN res_partner partner ON partner.id = doc.partner_id
+                         WHERE doc.id IN %s
+                        """,
+                        self.env.lang or "en_US",
+                        self.env["account.payment"]._search(self._bank_domain()).subselect(),
+                    ),
+                    [SQL("move.date"), SQL("doc.id")],
+                ),
+            }
+        return {}
+
+    def _csv_chunk(self, table, after, limit):
+        """SQL of the next ``limit`` CSV rows of ``table`` after the key values ``after`` (None: from the start)."""
+        _header, select, keys = self._csv_tables()[table]
+        keys = SQL(", ").join(keys)
+        return SQL(
+            "%s AND %s ORDER BY %s LIMIT %s",
+            select,
+            SQL("(%s) > %s", keys, tuple(after)) if after else SQL("TRUE"),
+            keys,
+            limit,
+        )
+
+    def _collect_payload(self, datasets=None):
+        """``datasets``: :meth:`_export_datasets`, when the export of all reports already read them."""
         if self.report_type == "profit_loss":
-            payload = self._collect_profit_loss()
-        elif self.report_type == "purchase_sales":
-            payload = self._collect_purchase_sales()
-        elif self.report_type == "supplier_customer":
-            payload = self._collect_supplier_customer()
-        elif self.report_type == "stock":
-            payload = self._collect_stock()
-        elif self.report_type == "product_purchase":
-            payload = self._collect_product_purchase()
-        elif self.report_type == "product_sale_user":
-            payload = self._collect_product_sale_user()
-        elif self.report_type == "purchase_payment":
-            payload = self._collect_purchase_payment()
-        elif self.report_type == "sales_payment":
-            payload = self._collect_sales_payment()
-        elif self.report_type == "bank":
-            payload = self._collect_bank()
+            return self._collect_profit_loss(datasets)
+        if self.report_type == "gross_margin":
+            return self._collect_gross_margin()
+        if self.report_type == "purchase_sales":
+            return self._collect_purchase_sales(datasets)
+        if self.report_type == "supplier_customer":
+            return self._collect_supplier_customer(datasets)
+        if self.report_type == "stock":
+            return self._collect_stock()
+        if self.report_type == "stock_location":
+            return self._collect_stock_location()
+        if self.report_type == "product_purchase":
+            return self._collect_product_purchase(datasets)
+        if self.report_type == "product_sale_user":
+            return self._collect_product_sale_user(datasets)
+        if self.report_type in PAYMENT_MOVE_TYPES:
+            return self._collect_invoice_payments(datasets)
+        if self.report_type == "bank":
+            return self._collect_bank(datasets)
+        return {}
+
+    def _get_payload(self, stream=False, datasets=None):
+        """
+        Payload of the selected report. Detail tables are lazy generators;
+        unless ``stream`` is set they are materialised into lists.
+        Streamed generators can be consumed once.
+
+        Materialised payloads of up to CACHE_MAX_ROWS table rows go through
+        bms.report.cache, so a repeat run with the same filters on unchanged
+        data is served without recomputation.
+        Pass ``bms_report_no_cache`` in the context to force a live run.
+        """
+        self.ensure_one()
+        use_cache = not self.env.context.get("bms_report_no_cache")
+        Cache = self.env["bms.report.cache"]
+        payload = Cache._lookup(self) if use_cache else None
+        if payload is None:
+            snapshot = Cache._data_snapshot()
+            payload = self._collect_payload(datasets)
+            if not stream:
+                payload = {
+                    key: list(value) if isinstance(value, GeneratorType) else value
+                    for key, value in payload.items()
+                }
+                rows = sum(len(value) for value in payload.values() if is_table(value))
+                if use_cache and rows <= CACHE_MAX_ROWS:
+                    Cache._store(self, payload, snapshot)
+        return payload
 
+    def _with_report_header(self, payload, generated_on=None):
         return {
-            "generated_on": fields.Datetime.now(),
+            "generated_on": generated_on or fields.Datetime.now(),
             "report_type": self.report_type,
-            "title": title,
+            "title": self._selection_label("report_type", self.report_type),
             "filters": self._base_filters(),
             **payload,
         }
 
+    def _collect_data(self, stream=False, datasets=None):
+        """Collect the selected report with its header (title, filters, date)."""
+        return self._with_report_header(self._get_payload(stream=stream, datasets=datasets))
+
+    def _snapshot_payload(self):
+        """
+        Collect the report once per filter set and keep it as a gzip JSON-lines
+        attachment on the wizard; the PDF and XLSX renderings both read that
+        snapshot, so printing after exporting (or re-rendering the template)
+        does not collect again while the report's data is unchanged.
+        """
+        self.ensure_one()
+        Cache = self.env["bms.report.cache"]
+        key = Cache._fingerprint(self)
+        if (
+            self.payload_key == key
+            and self.payload_attachment_id
+            and not Cache._changed_since(self.report_type, self.payload_snapshot)
+        ):
+            return
+        snapshot = Cache._data_snapshot()
+        payload = self._get_payload(stream=True)
+        streamed = any(isinstance(value, GeneratorType) for value in payload.values())
+        raw, summary = dump_payload(payload)
+        summary["generated_on"] = fields.Datetime.now()
+        self.payload_attachment_id.unlink()
+        attachment = self._store_report_file(f"bms_report_{self.id}.jsonl.gz", raw, "application/gzip")
+        self.write(
+            {
+                "payload_key": key,
+                "payload_snapshot": snapshot,
+                "payload_summary": dumps(summary),
+                "payload_attachment_id": attachment.id,
+            }
+        )
+        if (
+            streamed
+            and not self.env.context.get("bms_report_no_cache")
+            and sum(summary["row_counts"].values()) <= CACHE_MAX_ROWS
+        ):
+            Cache._store(
+                self,
+                {
+                    name: list(value) if is_table(value) else value
+                    for name, value in load_payload(raw, summary).items()
+                },
+                snapshot,
+            )
+
+    def _snapshot_data(self, max_rows=None):
+        """Report data read back from the snapshot; tables capped at ``max_rows`` when given."""
+        self._snapshot_payload()
+        summary = loads(self.payload_summary)
+        payload = load_payload(self.payload_attachment_id.raw, summary, max_rows=max_rows)
+        data = self._with_report_header(payload, generated_on=summary["generated_on"])
+        data["row_counts"] = summary["row_counts"]
+        data["pdf_row_limit"] = max_rows
+        return data
+
+    def _pdf_report_data(self):
+        return self._snapshot_data(max_rows=PDF_MAX_ROWS)
+
+    def _start_preview(self):
+        """
+        Collect the summary of a new preview session once: figures (and the
+        grouped tables not paged from the database) are kept with the session,
+        the other tables are paged by :meth:`_render_preview`.
+        """
+        self.ensure_one()
+        sources = self._detail_sources()
+        grouped = self._grouped_sources()
+        figures, tables = [], {}
+        if grouped:
+            payload = self._preview_figures()
+        else:
+            payload = self._get_payload(stream=True)
+        for key, value in payload.items():
+            if not is_table(value):
+                figures.append((key.replace("_", " ").title(), value))
+            elif key not in sources:
+                tables[key] = list(value)
+        cursors = {table: [None] for table in [*grouped, *sources]}
+        self.preview_state = dumps({"figures": figures, "tables": tables, "cursors": cursors})
+
+    def _preview_table(self, title, rows):
+        columns = list(rows[0]) if rows else []
+        return {
+            "title": title.replace("_", " ").title(),
+            "headers": [column.replace("_", " ").title() for column in columns],
+            "rows": [[row[column] for column in columns] for row in rows],
+        }
+
+    def _render_preview(self, page):
+        """
+        Page ``page`` of every table of the preview session. Grouped tables are
+        sliced from the session or paged by :meth:`_grouped_sources`; detail
+        tables are read after the (date, id) or id cursor the previous page
+        ended on, one row more than a page to know whether another page exists.
+        """
+        self.ensure_one()
+        state = loads(self.preview_state)
+        offset = (page - 1) * PREVIEW_PAGE_SIZE
+        tables, has_next = [], False
+        for key, rows in state["tables"].items():
+            has_next = has_next or len(rows) > offset + PREVIEW_PAGE_SIZE
+            tables.append(self._preview_table(key, rows[offset:offset + PREVIEW_PAGE_SIZE]))
+        for key, read_page in self._grouped_sources().items():
+            cursors = state["cursors"][key]
+            lines = []
+            if len(cursors) >= page:
+                lines, after = read_page(cursors[page - 1], PREVIEW_PAGE_SIZE)
+                if after is not None:
+                    has_next = True
+                    del cursors[page:]
+                    cursors.append(after)
+            tables.append(self._preview_table(key, lines))
+        for key, (model_name, domain, field_names, date_field, make_line) in self._detail_sources().items():
+            cursors = state["cursors"][key]
+            records = []
+            if len(cursors) >= page:
+                records = self.env[model_name].search_read(
+                    domain + self._keyset_domain(cursors[page - 1], date_field),
+                    field_names,
+                    order=f"{date_field}, id" if date_field else "id",
+                    limit=PREVIEW_PAGE_SIZE + 1,
+                )
+            if len(records) > PREVIEW_PAGE_SIZE:
+                has_next = True
+                records = records[:PREVIEW_PAGE_SIZE]
+                last = records[-1]
+                del cursors[page:]
+                cursors.append([last[date_field], last["id"]] if date_field else last["id"])
+            tables.append(self._preview_table(key, [make_line(record) for record in records]))
+        html = self.env["ir.qweb"]._render(
+            "DW_BMS.report_bms_preview",
+            {"figures": state["figures"], "tables": tables, "page": page, "first_row": offset + 1},
+        )
+        self.write(
+            {"preview_page": page, "preview_has_next": has_next, "preview_html": html, "preview_state": dumps(state)}
+        )
+
+    @api.onchange(*REPORT_FILTER_FIELDS)
+    def _onchange_filters_reset_preview(self):
+        self.preview_page = 0
+        self.preview_has_next = False
+        self.preview_html = False
+        self.preview_state = False
+
+    def _reopen(self):
+        return {
+            "type": "ir.actions.act_window",
+            "name": self._selection_label("report_type", self.report_type),
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_preview(self):
+        self._start_preview()
+        self._render_preview(1)
+        return self._reopen()
+
+    def action_preview_next(self):
+        self._render_preview(self.preview_page + 1)
+        return self._reopen()
+
+    def action_preview_previous(self):
+        self._render_preview(max(self.preview_page - 1, 1))
+        return self._reopen()
+
     def action_print_pdf(self):
         self.ensure_one()
         return self.env.ref("DW_BMS.action_bms_summary_pdf").report_action(self)
@@ -397,16 +1673,32 @@ class BmsReportWizard(models.TransientModel):
             row += 1
         return row + 1
 
-    def action_generate_xlsx(self):
-        self.ensure_one()
-        data = self._collect_data()
+    def _write_comparison_table(self, sheet, row, data, bold, money):
+        if not data.get("comparison_lines"):
+            return row
+        return self._write_table(
+            sheet,
+            row,
+            ["Figure", "Current", "Compared", "Change", "Change %"],
+            [
+                [l["figure"], l["current"], l["compare"], l["delta"], l["delta_pct"]]
+                for l in data["comparison_lines"]
+            ],
+            bold,
+            money,
+        )
 
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output, {"in_memory": True})
-        sheet = workbook.add_worksheet("BMS Report")
-        bold = workbook.add_format({"bold": True})
-        money = workbook.add_format({"num_format": "#,##0.00"})
+    def _comparison_columns(self, data):
+        """Extra headers of compared product lines, and a function reading their values."""
+        if not data["filters"].get("compare_with"):
+            return [], lambda line: []
+        return (
+            ["Compared Qty", "Compared Amount", "Change", "Change %"],
+            lambda line: [line["compare_qty"], line["compare_amount"], line["delta"], line["delta_pct"]],
+        )
 
+    def _write_xlsx_sheet(self, sheet, data, bold, money):
+        """Write one report payload top to bottom (row order is required by constant_memory)."""
         row = 0
         sheet.write(row, 0, data["title"], bold)
         row += 2
@@ -428,6 +1720,31 @@ class BmsReportWizard(models.TransientModel):
             row += 1
             sheet.write(row, 0, "Profit / Loss", bold)
             sheet.write(row, 1, data["profit_loss"], money)
+            row += 2
+            row = self._write_comparison_table(sheet, row, data, bold, money)
+        elif data["report_type"] == "gross_margin":
+            for label, key in (
+                ("Revenue", "total_revenue"),
+                ("Cost of Goods Sold", "total_cogs"),
+                ("Gross Margin", "total_margin"),
+            ):
+                sheet.write(row, 0, label, bold)
+                sheet.write(row, 1, data[key], money)
+                row += 1
+            sheet.write(row, 0, "Margin %", bold)
+            sheet.write(row, 1, data["total_margin_pct"])
+            row += 2
+            row = self._write_table(
+                sheet,
+                row,
+                ["Name", "Qty Sold", "Revenue", "COGS", "Margin", "Margin %"],
+                (
+                    [l["name"], l["qty"], l["revenue"], l["cogs"], l["margin"], l["margin_pct"]]
+                    for l in data["margin_lines"]
+                ),
+                bold,
+                money,
+            )
         elif data["report_type"] == "purchase_sales":
             sheet.write(row, 0, "Sales Total", bold)
             sheet.write(row, 1, data["sale_total"], money)
@@ -435,11 +1752,12 @@ class BmsReportWizard(models.TransientModel):
             sheet.write(row, 0, "Purchase Total", bold)
             sheet.write(row, 1, data["purchase_total"], money)
             row += 2
+            row = self._write_comparison_table(sheet, row, data, bold, money)
             row = self._write_table(
                 sheet,
                 row,
                 ["Sale Order", "Date", "Customer", "User", "Amount"],
-                [[l["name"], l["date"], l["partner"], l["user"], l["amount"]] for l in data["sale_lines"]],
+                ([l["name"], l["date"], l["partner"], l["user"], l["amount"]] for l in data["sale_lines"]),
                 bold,
                 money,
             )
@@ -447,7 +1765,7 @@ class BmsReportWizard(models.TransientModel):
                 sheet,
                 row,
                 ["Purchase Order", "Date", "Supplier", "Amount"],
-                [[l["name"], l["date"], l["partner"], l["amount"]] for l in data["purchase_lines"]],
+                ([l["name"], l["date"], l["partner"], l["amount"]] for l in data["purchase_lines"]),
                 bold,
                 money,
             )
@@ -469,6 +1787,38 @@ class BmsReportWizard(models.TransientModel):
                 money,
             )
         elif data["report_type"] == "stock":
+            if data.get("stock_date"):
+                sheet.write(row, 0, "Stock As Of", bold)
+                sheet.write(row, 1, str(data["stock_date"]))
+                row += 1
+            sheet.write(row, 0, "Total Qty", bold)
+            sheet.write(row, 1, data["stock_total_qty"])
+            row += 1
+            sheet.write(row, 0, "Total Value", bold)
+            sheet.write(row, 1, data["stock_total_value"], money)
+            row += 2
+            if data.get("stock_date"):
+                row = self._write_table(
+                    sheet,
+                    row,
+                    ["Product", "Qty", "Unit Cost", "Stock Value"],
+                    [[l["product"], l["qty_available"], l["unit_cost"], l["stock_value"]] for l in data["stock_lines"]],
+                    bold,
+                    money,
+                )
+            else:
+                row = self._write_table(
+                    sheet,
+                    row,
+                    ["Product", "Qty Available", "Forecast Qty", "Unit Cost", "Stock Value"],
+                    [
+                        [l["product"], l["qty_available"], l["forecast_qty"], l["unit_cost"], l["stock_value"]]
+                        for l in data["stock_lines"]
+                    ],
+                    bold,
+                    money,
+                )
+        elif data["report_type"] == "stock_location":
             sheet.write(row, 0, "Total Qty", bold)
             sheet.write(row, 1, data["stock_total_qty"])
             row += 1
@@ -478,29 +1828,42 @@ class BmsReportWizard(models.TransientModel):
             row = self._write_table(
                 sheet,
                 row,
-                ["Product", "Qty Available", "Forecast Qty", "Unit Cost", "Stock Value"],
-                [
-                    [l["product"], l["qty_available"], l["forecast_qty"], l["unit_cost"], l["stock_value"]]
-                    for l in data["stock_lines"]
-                ],
+                ["Storage Location", "Items", "Qty", "Stock Value"],
+                [[l["location"], l["items"], l["qty"], l["value"]] for l in data["location_lines"]],
+                bold,
+                money,
+            )
+            row = self._write_table(
+                sheet,
+                row,
+                ["Storage Location", "Product", "Qty", "Unit Cost", "Stock Value"],
+                (
+                    [l["location"], l["product"], l["qty"], l["unit_cost"], l["value"]]
+                    for l in data["location_product_lines"]
+                ),
                 bold,
                 money,
             )
         elif data["report_type"] == "product_purchase":
+            compare_headers, compare_values = self._comparison_columns(data)
             row = self._write_table(
                 sheet,
                 row,
-                ["Product", "Qty Purchased", "Amount"],
-                [[l["product"], l["qty"], l["amount"]] for l in data["product_lines"]],
+                ["Product", "Qty Purchased", "Amount"] + compare_headers,
+                [[l["product"], l["qty"], l["amount"]] + compare_values(l) for l in data["product_lines"]],
                 bold,
                 money,
             )
         elif data["report_type"] == "product_sale_user":
+            compare_headers, compare_values = self._comparison_columns(data)
             row = self._write_table(
                 sheet,
                 row,
-                ["Product", "User", "Qty Sold", "Amount"],
-                [[l["product"], l["user"], l["qty"], l["amount"]] for l in data["product_user_lines"]],
+                ["Product", "User", "Qty Sold", "Amount"] + compare_headers,
+                [
+                    [l["product"], l["user"], l["qty"], l["amount"]] + compare_values(l)
+                    for l in data["product_user_lines"]
+                ],
                 bold,
                 money,
             )
@@ -511,14 +1874,25 @@ class BmsReportWizard(models.TransientModel):
             sheet.write(row, 0, "Total Pending", bold)
             sheet.write(row, 1, data["total_pending"], money)
             row += 2
+            row = self._write_table(
+                sheet,
+                row,
+                ["Partner", "0-30 Days", "31-60 Days", "61-90 Days", "90+ Days", "Total Due"],
+                (
+                    [l["partner"], l["days_0_30"], l["days_31_60"], l["days_61_90"], l["days_90_plus"], l["total"]]
+                    for l in data["ageing_lines"]
+                ),
+                bold,
+                money,
+            )
             row = self._write_table(
                 sheet,
                 row,
                 ["Reference", "Date", "Partner", "Total", "Paid", "Pending", "Payment State"],
-                [
+                (
                     [l["name"], l["date"], l["partner"], l["total"], l["paid"], l["pending"], l["payment_state"]]
                     for l in data["payment_lines"]
-                ],
+                ),
                 bold,
                 money,
             )
@@ -526,8 +1900,8 @@ class BmsReportWizard(models.TransientModel):
             row = self._write_table(
                 sheet,
                 row,
-                ["Bank", "Amount"],
-                [[l["bank"], l["amount"]] for l in data["bank_lines"]],
+                ["Bank", "Month", "Amount"],
+                [[l["bank"], l.get("month", ""), l["amount"]] for l in data["bank_lines"]],
                 bold,
                 money,
             )
@@ -535,23 +1909,158 @@ class BmsReportWizard(models.TransientModel):
                 sheet,
                 row,
                 ["Date", "Payment", "Bank", "Partner", "Amount"],
-                [
+                (
                     [l["date"], l["name"], l["bank"], l["partner"], l["amount"]]
                     for l in data["bank_detail_lines"]
-                ],
+                ),
                 bold,
                 money,
             )
 
-        workbook.close()
-        file_data = base64.b64encode(output.getvalue())
-        filename = f"bms_report_{fields.Date.today()}.xlsx"
-        self.write({"xlsx_file": file_data, "xlsx_filename": filename})
+        return row
 
+    def _store_report_file(self, filename, raw, mimetype):
+        return self.env["ir.attachment"].create(
+            {
+                "name": filename,
+                "raw": raw,
+                "mimetype": mimetype,
+                "res_model": self._name,
+                "res_id": self.id,
+            }
+        )
+
+    @api.model
+    def _download_action(self, attachment):
         return {
-            "type": "ir.actions.act_window",
-            "res_model": "bms.report.wizard",
-            "res_id": self.id,
-            "view_mode": "form",
-            "target": "new",
+            "type": "ir.actions.act_url",
+            "url": f"/web/content/{attachment.id}?download=true",
+            "target": "self",
+        }
+
+    def _render_xlsx(self):
+        """
+        Stream the report snapshot into a constant_memory workbook backed by
+        a temp file: detail rows are decoded one at a time straight to disk,
+        and only the compressed result is loaded once to store it.
+        """
+        self.ensure_one()
+        data = self._snapshot_data()
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+            workbook = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+            sheet = workbook.add_worksheet("BMS Report")
+            bold = workbook.add_format({"bold": True})
+            money = workbook.add_format({"num_format": "#,##0.00"})
+            self._write_xlsx_sheet(sheet, data, bold, money)
+            workbook.close()
+            tmp.seek(0)
+            return tmp.read()
+
+    def _xlsx_sheet_name(self, label, used):
+        # Excel: at most 31 characters, no []:*?/\ and unique per workbook.
+        name = "".join("-" if char in "[]:*?/\\" else char for char in label)[:31]
+        candidate, index = name, 2
+        while candidate in used:
+            suffix = f" ({index})"
+            candidate, index = name[: 31 - len(suffix)] + suffix, index + 1
+        used.add(candidate)
+        return candidate
+
+    def _export_datasets(self, variants):
+        """
+        Aggregates of the filter set read once for the export of all reports,
+        from the wizard of each report type in ``variants`` so comparisons
+        follow the report. Invoice totals and the payment ageing of both
+        payment reports come from one grouped query each.
+        """
+        return {
+            "invoice_totals": self._invoice_totals(("out_invoice", "out_refund", "in_invoice", "in_refund")),
+            "payment_ageing": self._payment_ageing(list(PAYMENT_MOVE_TYPES)),
+            "order_totals": variants["purchase_sales"]._order_totals(),
+            "product_purchase_lines": variants["product_purchase"]._product_purchase_lines(),
+            "product_sale_user_lines": variants["product_sale_user"]._product_sale_user_lines(),
+            "partner_balances": self._supplier_customer_partners(),
+            "bank_groups": self._bank_groups(),
+        }
+
+    def _render_xlsx_all(self):
+        """
+        Every report type for the current filters, one sheet each, in one
+        constant_memory workbook. The aggregates behind the sheets are read
+        once by :meth:`_export_datasets`; each report only streams its
+        detail lines and still goes through the payload cache.
+        """
+        self.ensure_one()
+        report_types = [value for value, _label in self._fields["report_type"].selection]
+        filter_vals = self._filter_vals()
+        variants = {report_type: self.new(dict(filter_vals, report_type=report_type)) for report_type in report_types}
+        datasets = self._export_datasets(variants)
+        used_names = set()
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+            workbook = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+            bold = workbook.add_format({"bold": True})
+            money = workbook.add_format({"num_format": "#,##0.00"})
+            for report_type in report_types:
+                data = variants[report_type]._collect_data(stream=True, datasets=datasets)
+                sheet = workbook.add_worksheet(self._xlsx_sheet_name(data["title"], used_names))
+                self._write_xlsx_sheet(sheet, data, bold, money)
+            workbook.close()
+            tmp.seek(0)
+            return tmp.read()
+
+    def _render_report(self, output_format):
+        """Render the report file; returns ``(filename, raw, mimetype)``."""
+        self.ensure_one()
+        basename = f"bms_report_{fields.Date.today()}"
+        if output_format == "pdf":
+            raw, _ = self.env["ir.actions.report"]._render_qweb_pdf("DW_BMS.action_bms_summary_pdf", self.ids)
+            return f"{basename}.pdf", raw, "application/pdf"
+        if output_format == "xlsx_all":
+            return f"bms_reports_all_{fields.Date.today()}.xlsx", self._render_xlsx_all(), XLSX_MIMETYPE
+        return f"{basename}.xlsx", self._render_xlsx(), XLSX_MIMETYPE
+
+    def action_generate_xlsx(self):
+        self.ensure_one()
+        return self._download_action(self._store_report_file(*self._render_report("xlsx")))
+
+    def action_open_snapshot(self):
+        self.ensure_one()
+        return self.snapshot_run_id.action_download()
+
+    def action_export_csv(self):
+        self.ensure_one()
+        tables = self._csv_tables()
+        if not tables:
+            raise UserError("This report has no detail lines to export as CSV.")
+        table = self.csv_table if self.csv_table in tables else next(iter(tables))
+        url = f"/dw_bms/report/{self.id}/csv/{table}"
+        if self.csv_gzip:
+            url += "?compress=1"
+        return {"type": "ir.actions.act_url", "url": url, "target": "self"}
+
+    def action_export_all_xlsx(self):
+        self.ensure_one()
+        return self._download_action(self._store_report_file(*self._render_report("xlsx_all")))
+
+    def action_run_in_background(self):
+        """Queue the report (format from the button context) and let the cron worker build it."""
+        self.ensure_one()
+        run = self.env["bms.report.run"].create(
+            {
+                **self._filter_vals(),
+                "output_format": self.env.context.get("bms_output_format", "xlsx"),
+                "company_ids": [(6, 0, self.env.companies.ids)],
+            }
+        )
+        run._trigger_queue()
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": run.name,
+                "message": "The report is being generated in the background. "
+                           "You will be notified when it is ready.",
+                "type": "info",
+                "next": {"type": "ir.actions.act_window_close"},
+            },
         }
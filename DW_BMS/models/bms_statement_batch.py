@@ -0,0 +1,442 @@
+import logging
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+
+import xlsxwriter
+from odoo import api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.pdf import merge_pdf
+
+from .bms_report_wizard import XLSX_MIMETYPE
+
+_logger = logging.getLogger(__name__)
+
+# Statements rendered per cron transaction; the cron re-triggers itself while some are pending.
+STATEMENT_CHUNK_SIZE = 100
+# Statements per merged PDF part: one report rendering each.
+STATEMENT_PDF_CHUNK_SIZE = 25
+# Per-partner files are rendered one by one until a chunk has taken this long,
+# well inside the cron time limit.
+STATEMENT_CHUNK_SECONDS = 60
+# A chunk is tried at most this many times; a worker killed mid-chunk counts as an attempt.
+STATEMENT_MAX_ATTEMPTS = 3
+
+STATEMENT_ACCOUNT_TYPES = {"receivable": "asset_receivable", "payable": "liability_payable"}
+
+
+def _previous_month_start(model):
+    return (fields.Date.context_today(model).replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def _previous_month_end(model):
+    return fields.Date.context_today(model).replace(day=1) - timedelta(days=1)
+
+
+class BmsStatementBatch(models.Model):
+    """
+    Partner statements for many partners at once. Opening balance, period
+    debits and credits and closing balance of every partner come from one
+    grouped query over account.move.line; the ledger rows of each statement
+    carry a running balance computed by a window function. Files are
+    rendered by a cron in chunks, one transaction per chunk; a chunk that
+    keeps killing its worker fails the batch instead of blocking the queue.
+    """
+
+    _name = "bms.statement.batch"
+    _description = "BMS Statement Batch"
+    _order = "id desc"
+
+    name = fields.Char(compute="_compute_name", store=True)
+    account_type = fields.Selection(
+        [("receivable", "Customer Statements"), ("payable", "Supplier Statements")],
+        required=True,
+        default="receivable",
+    )
+    date_from = fields.Date(required=True, default=_previous_month_start)
+    date_to = fields.Date(required=True, default=_previous_month_end)
+    partner_ids = fields.Many2many(
+        "res.partner",
+        string="Partners",
+        help="Leave empty for every partner with a balance or movements in the period.",
+    )
+    company_id = fields.Many2one("res.company", required=True, default=lambda self: self.env.company)
+    currency_id = fields.Many2one(related="company_id.currency_id")
+    output_format = fields.Selection([("pdf", "PDF"), ("xlsx", "Excel")], required=True, default="pdf")
+    merge_files = fields.Boolean(
+        string="Single File",
+        help="One file with every statement instead of one file per partner (delivered as a zip).",
+    )
+    state = fields.Selection(
+        [
+            ("draft", "Draft"),
+            ("queued", "Queued"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="draft",
+        required=True,
+        readonly=True,
+        index=True,
+    )
+    line_ids = fields.One2many("bms.statement.batch.line", "batch_id", string="Statements", readonly=True)
+    line_count = fields.Integer(compute="_compute_line_counts")
+    done_count = fields.Integer(string="Rendered", compute="_compute_line_counts")
+    attachment_id = fields.Many2one("ir.attachment", string="File", readonly=True, ondelete="set null")
+    date_done = fields.Datetime(string="Completed On", readonly=True)
+    error_message = fields.Text(readonly=True)
+    attempt_count = fields.Integer(
+        string="Attempts", readonly=True, help="Attempts at rendering the current chunk of statements."
+    )
+
+    _sql_constraints = [
+        ("bms_statement_batch_dates", "CHECK(date_from <= date_to)", "The start date must be before the end date."),
+    ]
+
+    @api.depends("account_type", "date_from", "date_to")
+    def _compute_name(self):
+        for batch in self:
+            label = dict(batch._fields["account_type"].selection).get(batch.account_type, "Statements")
+            batch.name = f"{label} {batch.date_from or ''} - {batch.date_to or ''}"
+
+    @api.depends("line_ids.state")
+    def _compute_line_counts(self):
+        counts = {
+            (batch.id, state): count
+            for batch, state, count in self.env["bms.statement.batch.line"]._read_group(
+                [("batch_id", "in", self.ids)], ["batch_id", "state"], ["__count"]
+            )
+        }
+        for batch in self:
+            batch.done_count = counts.get((batch.id, "done"), 0)
+            batch.line_count = batch.done_count + counts.get((batch.id, "pending"), 0)
+
+    def _ledger_scope(self, partner_ids=None):
+        """Posted receivable (or payable) lines of the company up to ``date_to``."""
+        conditions = [
+            SQL("aml.parent_state = 'posted'"),
+            SQL("aml.account_type = %s", STATEMENT_ACCOUNT_TYPES[self.account_type]),
+            SQL("aml.company_id = %s", self.company_id.id),
+            SQL("aml.date <= %s", self.date_to),
+            SQL("aml.partner_id IS NOT NULL"),
+        ]
+        if partner_ids is not None:
+            conditions.append(SQL("aml.partner_id IN %s", tuple(partner_ids) or (None,)))
+        return SQL(" AND ").join(conditions)
+
+    def _partner_balances(self):
+        """``[(partner_id, opening, debit, credit, closing)]`` of every statement, in one grouped query."""
+        self.ensure_one()
+        self.env["account.move.line"].check_access_rights("read")
+        self.env.flush_all()
+        partner_ids = self.partner_ids.ids or None
+        self.env.cr.execute(
+            SQL(
+                """
+                SELECT aml.partner_id,
+                       COALESCE(SUM(aml.balance) FILTER (WHERE aml.date < %(date_from)s), 0),
+                       COALESCE(SUM(aml.debit) FILTER (WHERE aml.date >= %(date_from)s), 0),
+                       COALESCE(SUM(aml.credit) FILTER (WHERE aml.date >= %(date_from)s), 0),
+                       SUM(aml.balance)
+                  FROM account_move_line aml
+                 WHERE %(scope)s
+              GROUP BY aml.partner_id
+                HAVING %(selected)s
+                    OR SUM(aml.balance) != 0
+                    OR COUNT(*) FILTER (WHERE aml.date >= %(date_from)s) > 0
+                """,
+                date_from=self.date_from,
+                scope=self._ledger_scope(partner_ids),
+                selected=SQL("TRUE" if partner_ids else "FALSE"),
+            )
+        )
+        return self.env.cr.fetchall()
+
+    def _ledger_rows(self, partner_ids):
+        """
+        ``{partner_id: [row]}`` of the period's ledger lines of ``partner_ids``.
+        The running balance is a window sum over each partner's whole history,
+        so it already includes the opening balance.
+        """
+        self.ensure_one()
+        if not partner_ids:
+            return {}
+        self.env.cr.execute(
+            SQL(
+                """
+                SELECT partner_id, date, move_name, reference, date_maturity, debit, credit, running_balance
+                  FROM (
+                        SELECT aml.id, aml.partner_id, aml.date, move.name AS move_name,
+                               COALESCE(NULLIF(move.ref, ''), aml.name) AS reference,
+                               aml.date_maturity, aml.debit, aml.credit,
+                               SUM(aml.balance) OVER (
+                                   PARTITION BY aml.partner_id ORDER BY aml.date, aml.id
+                               ) AS running_balance
+                          FROM account_move_line aml
+                          JOIN account_move move ON move.id = aml.move_id
+                         WHERE %(scope)s
+                       ) ledger
+                 WHERE date >= %(date_from)s
+              ORDER BY partner_id, date, id
+                """,
+                scope=self._ledger_scope(partner_ids),
+                date_from=self.date_from,
+            )
+        )
+        ledger = {}
+        for partner_id, date, move_name, reference, date_maturity, debit, credit, balance in self.env.cr.fetchall():
+            ledger.setdefault(partner_id, []).append(
+                {
+                    "date": date,
+                    "name": move_name,
+                    "reference": reference or "",
+                    "date_maturity": date_maturity,
+                    "debit": debit,
+                    "credit": credit,
+                    "balance": balance,
+                }
+            )
+        return ledger
+
+    def _trigger_queue(self):
+        self.env.ref("DW_BMS.ir_cron_bms_statement_batch")._trigger()
+
+    def _store_file(self, filename, raw, mimetype):
+        return self.env["ir.attachment"].sudo().create(
+            {"name": filename, "raw": raw, "mimetype": mimetype, "res_model": self._name, "res_id": self.id}
+        )
+
+    def _clear_files(self):
+        attachments = self.attachment_id | self.line_ids.attachment_id
+        self.write({"attachment_id": False})
+        attachments.sudo().unlink()
+
+    def action_generate(self):
+        for batch in self:
+            if batch.state not in ("draft", "failed", "done"):
+                raise UserError("Statements of this batch are already being generated.")
+            balances = batch._partner_balances()
+            if not balances:
+                raise UserError("No partner has a balance or movements in this period.")
+            batch._clear_files()
+            batch.line_ids.unlink()
+            self.env["bms.statement.batch.line"].create(
+                [
+                    {
+                        "batch_id": batch.id,
+                        "partner_id": partner_id,
+                        "opening_balance": opening,
+                        "debit": debit,
+                        "credit": credit,
+                        "closing_balance": closing,
+                    }
+                    for partner_id, opening, debit, credit, closing in balances
+                ]
+            )
+            batch.write({"state": "queued", "date_done": False, "error_message": False, "attempt_count": 0})
+        self._trigger_queue()
+
+    def _process_chunk(self):
+        """Render the next chunk of pending statements; finish the batch after the last one."""
+        self.ensure_one()
+        merged_pdf = self.merge_files and self.output_format == "pdf"
+        lines = self.env["bms.statement.batch.line"].search(
+            [("batch_id", "=", self.id), ("state", "=", "pending")],
+            order="id",
+            limit=STATEMENT_PDF_CHUNK_SIZE if merged_pdf else STATEMENT_CHUNK_SIZE,
+        )
+        if not lines:
+            self._finish()
+            return
+        lines = lines.with_context(bms_statement_ledger=self._ledger_rows(lines.partner_id.ids))
+        if merged_pdf:
+            # One rendering per chunk; the parts are merged when the batch finishes.
+            raw, _ = lines.env["ir.actions.report"]._render_qweb_pdf("DW_BMS.action_bms_statement_pdf", lines.ids)
+            part = self._store_file(f"{self.name} ({lines[0].id}).pdf", raw, "application/pdf")
+            lines.write({"attachment_id": part.id})
+        elif not self.merge_files:
+            deadline = time.monotonic() + STATEMENT_CHUNK_SECONDS
+            rendered = lines.browse()
+            for line in lines:
+                filename, raw, mimetype = line._render_file()
+                line.attachment_id = self._store_file(filename, raw, mimetype)
+                rendered |= line
+                if time.monotonic() > deadline:
+                    break
+            lines = rendered
+        # A merged workbook is written in one pass by _finish.
+        lines.write({"state": "done"})
+
+    def _write_merged_xlsx(self):
+        lines = self.line_ids.sorted("id")
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+            workbook = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+            sheet = workbook.add_worksheet("Statements")
+            bold = workbook.add_format({"bold": True})
+            money = workbook.add_format({"num_format": "#,##0.00"})
+            row = 0
+            for start in range(0, len(lines), STATEMENT_CHUNK_SIZE):
+                chunk = lines[start:start + STATEMENT_CHUNK_SIZE]
+                chunk = chunk.with_context(bms_statement_ledger=self._ledger_rows(chunk.partner_id.ids))
+                for line in chunk:
+                    row = line._write_statement(sheet, row, bold, money)
+            workbook.close()
+            tmp.seek(0)
+            return tmp.read()
+
+    def _zip_files(self):
+        with tempfile.NamedTemporaryFile(suffix=".zip") as tmp:
+            with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+                for line in self.line_ids.sorted("id"):
+                    archive.writestr(line.attachment_id.name, line.attachment_id.raw)
+            tmp.seek(0)
+            return tmp.read()
+
+    def _finish(self):
+        basename = f"statements_{self.date_from}_{self.date_to}"
+        if self.merge_files and self.output_format == "xlsx":
+            attachment = self._store_file(f"{basename}.xlsx", self._write_merged_xlsx(), XLSX_MIMETYPE)
+        elif self.merge_files:
+            parts = self.line_ids.sorted("id").attachment_id
+            attachment = self._store_file(f"{basename}.pdf", merge_pdf(parts.mapped("raw")), "application/pdf")
+            self.line_ids.write({"attachment_id": False})
+            parts.sudo().unlink()
+        else:
+            attachment = self._store_file(f"{basename}.zip", self._zip_files(), "application/zip")
+        self.write({"state": "done", "attachment_id": attachment.id, "date_done": fields.Datetime.now()})
+
+    def _notify_requester(self):
+        self.ensure_one()
+        if self.state == "done":
+            message, notification_type = "Your statements are ready to download.", "success"
+        else:
+            message, notification_type = "Your statements could not be generated.", "danger"
+        self.env["bus.bus"]._sendone(
+            self.create_uid.partner_id,
+            "simple_notification",
+            {"title": self.name, "message": message, "type": notification_type, "sticky": True},
+        )
+
+    @api.model
+    def _cron_process_batches(self):
+        batch = self.search([("state", "in", ("queued", "running"))], order="id", limit=1)
+        if not batch:
+            return
+        if batch.attempt_count >= STATEMENT_MAX_ATTEMPTS:
+            # The previous workers were killed (time limit, out of memory) on this chunk.
+            _logger.warning("BMS statement batch %s was interrupted %s times, giving up", batch.id, batch.attempt_count)
+            batch.write({"state": "failed", "error_message": "Rendering was interrupted too many times."})
+        else:
+            # Committed first, so a worker killed while rendering still counts the attempt.
+            batch.write({"state": "running", "attempt_count": batch.attempt_count + 1})
+            self.env.cr.commit()
+            # Rendered with the requesting user's access rights.
+            batch = batch.with_user(batch.create_uid)
+            try:
+                with self.env.cr.savepoint():
+                    batch._process_chunk()
+                    batch.sudo().attempt_count = 0
+            except Exception as exc:
+                _logger.exception("BMS statement batch %s failed", batch.id)
+                batch.sudo().write({"state": "failed", "error_message": str(exc)})
+        if batch.state in ("done", "failed"):
+            batch._notify_requester()
+        # One chunk per transaction: rendered statements are never lost to a later failure.
+        self.env.cr.commit()
+        if self.search_count([("state", "in", ("queued", "running"))], limit=1):
+            self._trigger_queue()
+
+    def action_download(self):
+        self.ensure_one()
+        return self.env["bms.report.wizard"]._download_action(self.attachment_id)
+
+    def action_view_lines(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": self.name,
+            "res_model": "bms.statement.batch.line",
+            "view_mode": "tree",
+            "domain": [("batch_id", "=", self.id)],
+        }
+
+
+class BmsStatementBatchLine(models.Model):
+    _name = "bms.statement.batch.line"
+    _description = "BMS Partner Statement"
+    _order = "batch_id, id"
+
+    batch_id = fields.Many2one("bms.statement.batch", required=True, ondelete="cascade", index=True)
+    partner_id = fields.Many2one("res.partner", required=True, readonly=True)
+    company_id = fields.Many2one(related="batch_id.company_id")
+    currency_id = fields.Many2one(related="batch_id.currency_id")
+    opening_balance = fields.Monetary(readonly=True)
+    debit = fields.Monetary(readonly=True)
+    credit = fields.Monetary(readonly=True)
+    closing_balance = fields.Monetary(readonly=True)
+    state = fields.Selection([("pending", "Pending"), ("done", "Rendered")], default="pending", required=True)
+    attachment_id = fields.Many2one("ir.attachment", string="File", readonly=True, ondelete="set null")
+
+    def _ledger_lines(self):
+        """Ledger rows of this statement, from the chunk's prefetched ledger when there is one."""
+        self.ensure_one()
+        ledger = self.env.context.get("bms_statement_ledger")
+        if ledger is None:
+            ledger = self.batch_id._ledger_rows(self.partner_id.ids)
+        return ledger.get(self.partner_id.id, [])
+
+    def _write_statement(self, sheet, row, bold, money):
+        """Write this statement from ``row`` down; returns the next free row."""
+        self.ensure_one()
+        batch = self.batch_id
+        sheet.write(row, 0, self.partner_id.display_name, bold)
+        sheet.write(row, 1, f"{batch.date_from} - {batch.date_to}")
+        row += 1
+        sheet.write(row, 0, "Opening Balance", bold)
+        sheet.write(row, 6, self.opening_balance, money)
+        row += 1
+        rows = (
+            [
+                str(l["date"]),
+                l["name"],
+                l["reference"],
+                str(l["date_maturity"] or ""),
+                l["debit"],
+                l["credit"],
+                l["balance"],
+            ]
+            for l in self._ledger_lines()
+        )
+        headers = ["Date", "Entry", "Reference", "Due Date", "Debit", "Credit", "Balance"]
+        row = self.env["bms.report.wizard"]._write_table(sheet, row, headers, rows, bold, money) - 1
+        sheet.write(row, 0, "Closing Balance", bold)
+        sheet.write(row, 4, self.debit, money)
+        sheet.write(row, 5, self.credit, money)
+        sheet.write(row, 6, self.closing_balance, money)
+        return row + 2
+
+    def _render_file(self):
+        """Render this statement; returns ``(filename, raw, mimetype)``."""
+        self.ensure_one()
+        # The partner id keeps the names of same-named partners apart in the zip.
+        basename = f"statement_{self.partner_id.display_name}_{self.partner_id.id}_{self.batch_id.date_to}"
+        basename = basename.replace("/", "-")
+        if self.batch_id.output_format == "pdf":
+            raw, _ = self.env["ir.actions.report"]._render_qweb_pdf("DW_BMS.action_bms_statement_pdf", self.ids)
+            return f"{basename}.pdf", raw, "application/pdf"
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
+            workbook = xlsxwriter.Workbook(tmp.name, {"constant_memory": True})
+            sheet = workbook.add_worksheet("Statement")
+            self._write_statement(
+                sheet, 0, workbook.add_format({"bold": True}), workbook.add_format({"num_format": "#,##0.00"})
+            )
+            workbook.close()
+            tmp.seek(0)
+            return f"{basename}.xlsx", tmp.read(), XLSX_MIMETYPE
+
+    def action_download(self):
+        self.ensure_one()
+        return self.env["bms.report.wizard"]._download_action(self.attachment_id)
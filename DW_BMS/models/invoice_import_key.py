@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+dw_bms / models / invoice_import_key.py
+
+Natural-key registry used by the invoice import to get-or-create partners and
+products safely when several users import overlapping files at the same time.
+
+The unique (kind, key) constraint is the arbiter: the first transaction to
+INSERT a key owns its creation; every other transaction either sees the
+committed claim and reuses the record, or (under REPEATABLE READ) gets a
+serialization failure and is retried by the request dispatcher with a fresh
+snapshot in which the claim is visible.
+"""
+
+from odoo import fields, models
+
+
+class DwInvoiceImportKey(models.Model):
+    _name = "dw.invoice.import.key"
+    _description = "Invoice Import Natural Key"
+    _log_access = False
+
+    kind = fields.Selection(
+        selection=[
+            ("partner", "Partner"),
+            ("product", "Product"),
+        ],
+        required=True,
+    )
+    key = fields.Char(required=True)
+    res_id = fields.Integer(string="Record ID")
+
+    _sql_constraints = [
+        (
+            "dw_invoice_import_key_uniq",
+            "unique(kind, key)",
+            "This natural key has already been claimed by an import.",
+        )
+    ]
+
+    def _claim(self, kind, key):
+        """
+        Try to claim ``key`` for creation.
+
+        Returns ``(claim_id, res_id)``:
+          • ``res_id`` is False when this transaction now owns the key and must
+            create the record, then call :meth:`_assign`;
+          • otherwise ``res_id`` is the record created by an earlier import.
+        """
+        cr = self.env.cr
+        cr.execute(
+            """
+            INSERT INTO dw_invoice_import_key (kind, key)
+            VALUES (%s, %s)
+            ON CONFLICT (kind, key) DO NOTHING
+            RETURNING id
+            """,
+            [kind, key],
+        )
+        row = cr.fetchone()
+        if row:
+            return row[0], False
+        cr.execute(
+            "SELECT id, res_id FROM dw_invoice_import_key WHERE kind = %s AND key = %s",
+            [kind, key],
+        )
+        claim_id, res_id = cr.fetchone()
+        return claim_id, res_id or False
+
+    def _assign(self, claim_id, res_id):
+        self.env.cr.execute(
+            "UPDATE dw_invoice_import_key SET res_id = %s WHERE id = %s",
+            [res_id, claim_id],
+        )
@@ -4,9 +4,17 @@ dw_bms / models / invoice_import_log.py
 
 Stores a record for each XLSX import batch.
 Every batch has a set of log lines — one per invoice in the XLSX.
+
+After an import the batch runs a variance stage: imported totals
+(grand total, line totals, taxable value, tax / GST split) are compared with
+what Odoo computed for the posted invoices, and mismatching lines are flagged.
 """
 
-from odoo import fields, models, api
+from odoo import api, fields, models
+
+# One label per (imported, computed) column pair returned by
+# DwInvoiceImportLog._fetch_variance_rows(), in the same order.
+VARIANCE_LABELS = ["Grand total", "Line total", "Taxable value", "Tax amount"]
 
 
 class DwInvoiceImportLog(models.Model):
@@ -39,6 +47,14 @@ class DwInvoiceImportLog(models.Model):
     created = fields.Integer(string="Created", readonly=True)
     skipped = fields.Integer(string="Skipped (Duplicate)", readonly=True)
     failed = fields.Integer(string="Failed", readonly=True)
+    variance_count = fields.Integer(string="Total Mismatches", readonly=True)
+    variance_tolerance = fields.Float(
+        string="Variance Tolerance",
+        digits=(16, 2),
+        default=1.0,
+        help="Maximum absolute difference allowed between an imported amount and "
+             "the amount computed by Odoo before the invoice is flagged.",
+    )
 
     # ─── State ───────────────────────────────────────────────────────────────
     state = fields.Selection(
@@ -69,6 +85,77 @@ class DwInvoiceImportLog(models.Model):
                 ) or "IMP/0001"
         return super().create(vals_list)
 
+    # ─── Variance stage ──────────────────────────────────────────────────────
+    def action_check_variance(self):
+        """Button: (re)run the imported-vs-computed totals check."""
+        for log in self:
+            log._check_totals_variance()
+
+    def _fetch_variance_rows(self, move_ids):
+        """
+        Imported vs computed amounts for all ``move_ids`` in one grouped query.
+        Imported tax falls back to the CGST+SGST+IGST split when no total tax
+        column was mapped.
+        """
+        self.env["account.move"].flush_model(["amount_total", "dw_grand_total_imported"])
+        self.env["account.move.line"].flush_model([
+            "price_total", "price_subtotal", "display_type", "dw_line_total_imported",
+            "dw_taxable_value", "dw_total_tax_amount", "dw_cgst_amount",
+            "dw_sgst_amount", "dw_igst_amount",
+        ])
+        self.env.cr.execute(
+            """
+            SELECT m.id,
+                   COALESCE(m.dw_grand_total_imported, 0),
+                   COALESCE(m.amount_total, 0),
+                   COALESCE(SUM(l.dw_line_total_imported), 0),
+                   COALESCE(SUM(l.price_total), 0),
+                   COALESCE(SUM(l.dw_taxable_value), 0),
+                   COALESCE(SUM(l.price_subtotal), 0),
+                   COALESCE(
+                       NULLIF(SUM(l.dw_total_tax_amount), 0),
+                       SUM(COALESCE(l.dw_cgst_amount, 0)
+                           + COALESCE(l.dw_sgst_amount, 0)
+                           + COALESCE(l.dw_igst_amount, 0)),
+                       0
+                   ),
+                   COALESCE(SUM(l.price_total - l.price_subtotal), 0)
+              FROM account_move m
+         LEFT JOIN account_move_line l
+                ON l.move_id = m.id AND l.display_type = 'product'
+             WHERE m.id = ANY(%s)
+          GROUP BY m.id
+            """,
+            [list(move_ids)],
+        )
+        return self.env.cr.fetchall()
+
+    def _check_totals_variance(self):
+        """
+        Compare imported and computed totals column-wise for the whole batch and
+        flag the mismatching log lines. Amounts imported as 0 are treated as
+        "column not provided" and never flagged.
+        """
+        self.ensure_one()
+        lines = self.log_line_ids.filtered(lambda l: l.status == "created" and l.move_id)
+        line_by_move = {line.move_id.id: line for line in lines}
+        flagged = {}
+        rows = self._fetch_variance_rows(line_by_move) if line_by_move else []
+        for move_id, *amounts in rows:
+            pairs = zip(VARIANCE_LABELS, map(float, amounts[0::2]), map(float, amounts[1::2]))
+            mismatches = [
+                f"{label}: imported {imported:.2f}, computed {computed:.2f}"
+                for label, imported, computed in pairs
+                if imported and abs(imported - computed) > self.variance_tolerance
+            ]
+            if mismatches:
+                flagged[move_id] = "; ".join(mismatches)
+
+        self.log_line_ids.filtered("has_variance").write({"has_variance": False, "variance_note": False})
+        for move_id, note in flagged.items():
+            line_by_move[move_id].write({"has_variance": True, "variance_note": note})
+        self.variance_count = len(flagged)
+
 
 class DwInvoiceImportLogLine(models.Model):
     """
@@ -103,3 +190,5 @@ class DwInvoiceImportLogLine(models.Model):
         string="Invoice",
         ondelete="set null",
     )
+    has_variance = fields.Boolean(string="Total Mismatch", readonly=True, index=True)
+    variance_note = fields.Char(string="Mismatch Details", readonly=True)
@@ -10,6 +10,7 @@ Import engine:
   • Reads rows using confirmed mapping (not positional)
   • Groups rows by invoice_number field
   • Skips duplicates; auto-creates partners (GSTIN-validated) and products
+    through dw.invoice.import.key claims, so parallel imports never duplicate them
   • Resolves CGST+SGST vs IGST, creates invoice, posts, pays, reconciles
   • Writes dw.invoice.import.log and opens it after import
 """
@@ -21,8 +22,11 @@ import re
 from collections import defaultdict
 from datetime import datetime, timedelta
 
+from psycopg2 import OperationalError
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
 
 from .invoice_import_column_map import ODOO_FIELD_SELECTION
 
@@ -276,6 +280,13 @@ class DwInvoiceImportWizard(models.TransientModel):
         readonly=True,
         default="Review the auto-detected mappings below. Change any dropdown to correct it, then click Import.",
     )
+    variance_tolerance = fields.Float(
+        string="Variance Tolerance",
+        digits=(16, 2),
+        default=1.0,
+        help="Imported totals differing from Odoo's computed totals by more than this "
+             "amount are flagged on the import log.",
+    )
 
     # ── STEP 1: Read headers ──────────────────────────────────────────────────
 
@@ -424,6 +435,11 @@ class DwInvoiceImportWizard(models.TransientModel):
                         skipped += 1
                     log_lines.append(result)
             except Exception as exc:
+                if isinstance(exc, OperationalError) and exc.pgcode in PG_CONCURRENCY_ERRORS_TO_RETRY:
+                    # A parallel import touched the same partner/product: let the
+                    # request dispatcher retry the whole import on a fresh snapshot
+                    # instead of recording this invoice as failed.
+                    raise
                 failed += 1
                 _logger.exception("Import failed [%s]: %s", inv_number, exc)
                 log_lines.append({
@@ -441,6 +457,7 @@ class DwInvoiceImportWizard(models.TransientModel):
             "skipped": skipped,
             "failed": failed,
             "state": "done" if failed == 0 else "partial",
+            "variance_tolerance": self.variance_tolerance,
             "log_line_ids": [
                 (0, 0, {
                     "invoice_number": ll["invoice_number"],
@@ -456,6 +473,9 @@ class DwInvoiceImportWizard(models.TransientModel):
             if line.move_id and line.status == "created":
                 line.move_id.sudo().write({"import_log_line_id": line.id})
 
+        # Post-import stage: flag invoices whose imported totals disagree with Odoo's.
+        log._check_totals_variance()
+
         return {
             "type": "ir.actions.act_window",
             "name": _("Import Log — %s", log.name),
@@ -670,6 +690,19 @@ class DwInvoiceImportWizard(models.TransientModel):
         )
         if p:
             return p
+
+        # Claim the natural key before creating, so a parallel import of the
+        # same customer reuses this partner instead of creating a twin.
+        if gstin and _gstin_ok(gstin):
+            key = f"{company_id}:vat:{gstin.upper()}"
+        else:
+            key = f"{company_id}:name:{name.lower()}"
+        Key = self.env["dw.invoice.import.key"].sudo()
+        claim_id, res_id = Key._claim("partner", key)
+        p = Partner.browse(res_id).exists()
+        if p:
+            return p
+
         vals = {"name": name, "customer_rank": 1}
         if gstin and _gstin_ok(gstin):
             vals["vat"] = gstin.upper()
@@ -684,7 +717,9 @@ class DwInvoiceImportWizard(models.TransientModel):
         if _safe(header.get("contact_number")):
             vals["phone"] = _safe(header.get("contact_number"))
         vals["company_id"] = company_id
-        return Partner.create(vals)
+        partner = Partner.create(vals)
+        Key._assign(claim_id, partner.id)
+        return partner
 
     def _get_or_create_product(self, row):
         PP = self.env["product.product"].sudo()
@@ -726,6 +761,13 @@ class DwInvoiceImportWizard(models.TransientModel):
             return product_uom_id
 
         p = PP.search([("name", "=ilike", name)], limit=1)
+        claim_id = False
+        if not p:
+            # Same natural-key claim as partners: a product being created by a
+            # parallel import is picked up here rather than duplicated.
+            Key = self.env["dw.invoice.import.key"].sudo()
+            claim_id, res_id = Key._claim("product", name.lower())
+            p = PP.browse(res_id).exists()
         if p:
             if product_location:
                 p.product_tmpl_id.sudo().write({"product_storage_location": product_location})
@@ -743,7 +785,10 @@ class DwInvoiceImportWizard(models.TransientModel):
             tmpl_vals["uom_po_id"] = product_uom_id
 
         tmpl = self.env["product.template"].sudo().create(tmpl_vals)
-        return tmpl.product_variant_ids[0], product_uom_id
+        product = tmpl.product_variant_ids[0]
+        if claim_id:
+            Key._assign(claim_id, product.id)
+        return product, product_uom_id
 
     def _get_taxes(self, tax_pct, is_intra):
         Tax = self.env["account.tax"].sudo()
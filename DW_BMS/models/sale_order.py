@@ -58,6 +58,8 @@ class SaleOrder(models.Model):
         compute="_compute_total_products_weight",
         store=True,
     )
+    # sale_stock's stored status, indexed for the report shipping filters.
+    delivery_status = fields.Selection(index=True)
 
     @api.depends("order_line.product_id.weight", "order_line.product_uom_qty", "order_line.display_type")
     def _compute_total_products_weight(self):
@@ -0,0 +1,30 @@
+from odoo import models
+from odoo.tools.sql import create_index
+
+
+class StockMove(models.Model):
+    _inherit = "stock.move"
+
+    def init(self):
+        super().init()
+        # Done moves up to a date, for the as-of-date stock report.
+        create_index(
+            self.env.cr,
+            "stock_move_bms_done_date_idx",
+            self._table,
+            ["date", "company_id", "product_id"],
+            where="state = 'done'",
+        )
+
+
+class StockValuationLayer(models.Model):
+    _inherit = "stock.valuation.layer"
+
+    def init(self):
+        super().init()
+        create_index(
+            self.env.cr,
+            "stock_valuation_layer_bms_date_idx",
+            self._table,
+            ["create_date", "company_id", "product_id"],
+        )